@@ -1,10 +1,17 @@
+import asyncio
+
 from loguru import logger
 from telegram import Update
 from telegram.ext import Application
 
-from .database import Database
+from .database import Database, AsyncDatabase
 from .config.secrets import TELEGRAM_TOKEN
-from .config.services import SERVICES 
+from .config.services import SERVICES, load_services, stop_loading_services
+from .config.session import SESSION_SWEEP_INTERVAL, SESSION_SWEEP_BATCH
+from .services import ArrService
+from .services.transport import close_clients
+from .metrics import log_snapshot
+from .poster_cache import poster_cache, poster_store
 from .tg_handler import get_clbk_handler, get_help_handler
 from .tg_handler.auth import get_auth_handler
 
@@ -13,9 +20,32 @@ def init():
     pass
 
 
+async def post_init(application):
+    logger.info('Loading services in the background...')
+    load_services()
+    await asyncio.to_thread(ArrService.session_db.migrate)
+    await asyncio.to_thread(poster_cache.load)
+    await asyncio.to_thread(poster_store.load)
+
+
+async def sweep_sessions(context):
+    await asyncio.to_thread(ArrService.session_db.sweep, SESSION_SWEEP_BATCH)
+
+
+async def post_shutdown(application):
+    await stop_loading_services()
+    logger.info('Closing service connections...')
+    await close_clients()
+    logger.info('Writing pending session data...')
+    ArrService.session_db.flush()
+    logger.info('Closing database...')
+    await application.bot_data["db"].close()
+    log_snapshot()
+
+
 def main():
     logger.info('Initializing database...')
-    db = Database()
+    db = AsyncDatabase(Database())
 
     logger.info('Creating bot...')
     # v1.1 needed while this issue is open https://github.com/python-hyper/h2/issues/1199 
@@ -23,7 +53,10 @@ def main():
         .token(TELEGRAM_TOKEN)\
         .http_version("1.1")\
         .get_updates_http_version("1.1")\
+        .post_init(post_init)\
+        .post_shutdown(post_shutdown)\
         .build() 
+    application.bot_data["db"] = db
 
     logger.info('Registering auth command...')
     application.add_handler(get_auth_handler(db))
@@ -38,6 +71,14 @@ def main():
     logger.info('Registering callback handler...')
     application.add_handler(get_clbk_handler(SERVICES))
 
+    if application.job_queue:
+        logger.info('Scheduling session sweeper...')
+        application.job_queue.run_repeating(
+            sweep_sessions, interval=SESSION_SWEEP_INTERVAL, first=SESSION_SWEEP_INTERVAL
+        )
+    else:
+        logger.warning('No job queue available, expired sessions will not be removed')
+
     logger.info('Start polling for messages..')
     application.run_polling(allowed_updates=Update.ALL_TYPES)
 
@@ -0,0 +1,74 @@
+from loguru import logger
+from typing import Iterable, Optional
+
+from .config.backend import BACKEND_URL, BACKEND_PREFIX
+
+
+class RedisBackend:
+    """
+    Key-value store shared by several bot instances, speaking the Redis
+    protocol (Redis, Valkey, KeyDB, ...).
+
+    Sessions, results and lookups stored here can be served by any instance.
+    Expiry is left to the server. Pass `client` to use an existing
+    (e.g. in-process stand-in) client instead of connecting to `url`.
+
+    Calls block on the network, so callers on the event loop run them in a
+    worker thread (`asyncio.to_thread`).
+    """
+
+    def __init__(self, url: Optional[str] = None, prefix: str = BACKEND_PREFIX, client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise ImportError(
+                    "The shared backend requires the redis package (pip install redis)"
+                ) from e
+            client = redis.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def key(self, *parts) -> str:
+        return ":".join([self.prefix, *map(str, parts)])
+
+    def pipeline(self):
+        return self.client.pipeline(transaction=False)
+
+    def get(self, key: str, ttl: Optional[float] = None) -> Optional[bytes]:
+        # Renews the expiry of the key if a ttl is given
+        if not ttl:
+            return self.client.get(key)
+        pipe = self.pipeline()
+        pipe.get(key)
+        pipe.pexpire(key, int(ttl * 1000))
+        return pipe.execute()[0]
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        self.client.set(key, value, px=int(ttl * 1000) if ttl else None)
+
+    def expire(self, key: str, ttl: float):
+        self.client.pexpire(key, int(ttl * 1000))
+
+    def delete(self, keys: Iterable[str]):
+        keys = list(keys)
+        if keys:
+            self.client.delete(*keys)
+
+    def hget(self, key: str, field: str) -> Optional[bytes]:
+        return self.client.hget(key, field)
+
+    def members(self, key: str) -> Iterable[str]:
+        return [m.decode() if isinstance(m, bytes) else m for m in self.client.smembers(key)]
+
+
+_backend = None
+
+
+def get_backend() -> Optional[RedisBackend]:
+    # The configured shared backend, or None if state is kept locally
+    global _backend
+    if _backend is None and BACKEND_URL:
+        logger.info(f"Using shared backend {BACKEND_URL.split('@')[-1]}")
+        _backend = RedisBackend(BACKEND_URL)
+    return _backend
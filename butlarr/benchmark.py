@@ -0,0 +1,143 @@
+"""
+Micro benchmarks of butlarr internals.
+
+Usage: python -m butlarr.benchmark [session_codec] [auth]
+"""
+
+import os
+import asyncio
+import sys
+import pickle
+import sqlite3
+import timeit
+import tempfile
+
+from loguru import logger
+
+from .services.sonarr import State, SeasonState
+from .result_store import ResultSet
+from .database import Database
+from . import session_codec
+
+
+def _sample_item(i):
+    # Roughly the shape of a Sonarr lookup result
+    return {
+        "title": f"Series {i}",
+        "sortTitle": f"series {i}",
+        "status": "continuing",
+        "overview": "A long overview of the series, as returned by the upstream metadata provider. "
+        * 4,
+        "network": "Network",
+        "images": [
+            {"coverType": t, "remoteUrl": f"https://artworks.thetvdb.com/{t}/{i}.jpg"}
+            for t in ["banner", "poster", "fanart"]
+        ],
+        "remotePoster": f"https://artworks.thetvdb.com/poster/{i}.jpg",
+        "seasons": [{"seasonNumber": s, "monitored": True} for s in range(1, 8)],
+        "year": 2000 + i % 25,
+        "runtime": 45,
+        "tvdbId": 100000 + i,
+        "imdbId": f"tt{1000000 + i}",
+        "genres": ["Drama", "Science Fiction"],
+        "tags": [],
+        "folderName": f"/tv/Series {i}",
+        "qualityProfileId": 1,
+        "languageProfileId": 1,
+        "ratings": {"votes": 1234, "value": 8.1},
+    }
+
+
+def _sample_state(items):
+    return State(
+        items=items,
+        index=3,
+        quality_profile={"id": 1, "name": "HD-1080p"},
+        language_profile={"id": 1, "name": "English"},
+        tags=[],
+        root_folder={"id": 1, "path": "/tv/"},
+        seasons=SeasonState(available=list(range(1, 8)), selected=[]),
+        menu="add",
+    )
+
+
+def _measure(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number * 1e6
+
+
+def bench_session_codec(number=2000):
+    items = [_sample_item(i) for i in range(50)]
+    cases = {
+        "reference-only state": _sample_state(
+            asyncio.run(ResultSet.create(items, ("lookup", "series")))
+        ),
+        "state with 50 full items": _sample_state(items),
+    }
+    codecs = {
+        "pickle": (pickle.dumps, pickle.loads),
+        "session_codec": (session_codec.encode, session_codec.decode),
+    }
+
+    print(f"{'case':<28}{'codec':<16}{'bytes':>8}{'encode µs':>12}{'decode µs':>12}")
+    for case, state in cases.items():
+        for codec, (encode, decode) in codecs.items():
+            data = encode(state)
+            assert decode(data) == state or case == "reference-only state"
+            enc = _measure(lambda: encode(state), number)
+            dec = _measure(lambda: decode(data), number)
+            print(f"{case:<28}{codec:<16}{len(data):>8}{enc:>12.1f}{dec:>12.1f}")
+
+
+def _connect_per_lookup(db_file, user_id):
+    # Auth lookups as done before the connection was kept open
+    con = sqlite3.connect(db_file, timeout=30)
+    con.execute("PRAGMA journal_mode = off;")
+    record = con.execute("SELECT * FROM users WHERE id=?;", (user_id,)).fetchone()
+    con.close()
+    return record
+
+
+def bench_auth(number=5000, users=100):
+    logger.remove()
+    with tempfile.TemporaryDirectory() as path:
+        db = Database(os.path.join(path, "db.sqlite"))
+        for i in range(users):
+            db.add_user(i, f"user{i}", 1)
+        # Separate copy, as the journal mode can not be changed while the db is in use
+        legacy_file = os.path.join(path, "legacy.sqlite")
+        with sqlite3.connect(legacy_file) as con:
+            con.execute(
+                "CREATE TABLE users (id integer primary key, username text not null, auth_level integer);"
+            )
+            con.executemany(
+                "INSERT INTO users VALUES (:id, :username, :auth_level);",
+                db.get_users(min_auth_level=1),
+            )
+        con.close()
+        cases = {
+            "connection per lookup": lambda: _connect_per_lookup(
+                legacy_file, number % users
+            ),
+            "long-lived connection": lambda: db._execute_query(
+                "SELECT * FROM users WHERE id=?;", (number % users,), fetch="one"
+            ),
+            "in-memory auth levels": lambda: db.get_auth_level(number % users),
+        }
+        print(f"{'case':<28}{'µs':>10}{'lookups/s':>12}")
+        for case, func in cases.items():
+            t = _measure(func, number)
+            print(f"{case:<28}{t:>10.1f}{1e6 / t:>12.0f}")
+        db.close()
+
+
+BENCHMARKS = {
+    "session_codec": bench_session_codec,
+    "auth": bench_auth,
+}
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHMARKS.keys())
+    for name in names:
+        assert name in BENCHMARKS, f"Unknown benchmark {name}. Options: {list(BENCHMARKS)}"
+        print(f"\n== {name}")
+        BENCHMARKS[name]()
@@ -0,0 +1,86 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Callable, Hashable, Iterator, Optional, Tuple
+
+
+class LRUCache:
+    """
+    Least recently used cache, bounded by entry count and/or total size.
+
+    The size of an entry is determined by `sizeof` (defaults to `len`).
+    `on_evict` is called with the key and value of every evicted entry.
+    """
+
+    lock: Lock
+    max_entries: Optional[int]
+    max_size: Optional[int]
+    size: int
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        max_size: Optional[int] = None,
+        sizeof: Callable[[Any], int] = len,
+        on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+    ):
+        self.lock = Lock()
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.size = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable):
+        return key in self._entries
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key: Hashable, value: Any):
+        size = self.sizeof(value) if self.max_size is not None else 0
+        with self.lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            evicted = self._evict()
+        if self.on_evict:
+            for evicted_key, evicted_value in evicted:
+                self.on_evict(evicted_key, evicted_value)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self.lock:
+            if key not in self._entries:
+                return default
+            value, size = self._entries.pop(key)
+            self.size -= size
+            return value
+
+    def items(self) -> Iterator[Tuple[Hashable, Any]]:
+        with self.lock:
+            entries = list(self._entries.items())
+        return ((key, value) for key, (value, _) in entries)
+
+    def clear(self):
+        with self.lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _evict(self):
+        evicted = []
+        while self._entries and (
+            (self.max_entries is not None and len(self._entries) > self.max_entries)
+            or (self.max_size is not None and self.size > self.max_size)
+        ):
+            key, (value, size) = self._entries.popitem(last=False)
+            self.size -= size
+            evicted.append((key, value))
+        return evicted
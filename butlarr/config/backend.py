@@ -0,0 +1,9 @@
+from . import CONFIG
+
+BACKEND_CONFIG = CONFIG.get("backend") or {}
+
+# Url of a shared Redis protocol server (e.g. redis://localhost:6379/0).
+# Without one, sessions and caches are kept in local files.
+BACKEND_URL = BACKEND_CONFIG.get("url")
+# Prefix of all keys written, so one server can be shared
+BACKEND_PREFIX = BACKEND_CONFIG.get("prefix", "butlarr")
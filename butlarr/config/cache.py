@@ -0,0 +1,36 @@
+from . import CONFIG
+
+CACHE_CONFIG = CONFIG.get("cache") or {}
+
+# Seconds until root folders, profiles and tags are refreshed in the background
+REFERENCE_TTL = CACHE_CONFIG.get("reference_ttl", 3600)
+
+# Seconds lookup (search) results are served from the cache
+LOOKUP_TTL = CACHE_CONFIG.get("lookup_ttl", 3600)
+# Seconds empty lookup results are cached
+LOOKUP_NEGATIVE_TTL = CACHE_CONFIG.get("lookup_negative_ttl", 300)
+# Upper bounds of the in-memory (bytes of serialized results) and on-disk (rows) tiers
+LOOKUP_MEMORY_SIZE = CACHE_CONFIG.get("lookup_memory_size", 16 * 1024 * 1024)
+LOOKUP_DISK_ENTRIES = CACHE_CONFIG.get("lookup_disk_entries", 1000)
+
+# Number of lookup/library items kept for browsing sessions, across all sessions
+RESULT_STORE_ITEMS = CACHE_CONFIG.get("result_store_items", 50000)
+
+# Number of callback payloads too long for Telegram's 64 byte limit, kept server-side
+CALLBACK_PAYLOAD_ENTRIES = CACHE_CONFIG.get("callback_payload_entries", 10000)
+
+# Number of Telegram file ids of sent posters kept, and seconds poster urls that
+# Telegram could not fetch are replaced by the default poster
+POSTER_ENTRIES = CACHE_CONFIG.get("poster_entries", 10000)
+POSTER_NEGATIVE_TTL = CACHE_CONFIG.get("poster_negative_ttl", 24 * 60 * 60)
+# Bytes of downscaled posters kept on disk, their max width in pixels and the
+# number of posters fetched in the background at once
+POSTER_DISK_SIZE = CACHE_CONFIG.get("poster_disk_size", 64 * 1024 * 1024)
+POSTER_MAX_WIDTH = CACHE_CONFIG.get("poster_max_width", 500)
+POSTER_PREFETCH_CONCURRENCY = CACHE_CONFIG.get("poster_prefetch_concurrency", 4)
+
+# Seconds responses fetched ahead of the next tap (e.g. seasons of the next
+# search result) are reused, the number kept and fetched at once
+PREFETCH_TTL = CACHE_CONFIG.get("prefetch_ttl", 60)
+PREFETCH_ENTRIES = CACHE_CONFIG.get("prefetch_entries", 1000)
+PREFETCH_CONCURRENCY = CACHE_CONFIG.get("prefetch_concurrency", 4)
@@ -0,0 +1,21 @@
+from . import CONFIG
+
+HTTP_CONFIG = CONFIG.get("http") or {}
+
+# Connection pool limits, shared by all services pointing at the same api host
+POOL_MAX_CONNECTIONS = HTTP_CONFIG.get("max_connections", 20)
+POOL_MAX_KEEPALIVE_CONNECTIONS = HTTP_CONFIG.get("max_keepalive_connections", 10)
+POOL_KEEPALIVE_EXPIRY = HTTP_CONFIG.get("keepalive_expiry", 30)
+
+TIMEOUTS_CONFIG = CONFIG.get("timeouts") or {}
+
+# Total time budget (seconds) all arr requests of one telegram update draw from
+UPDATE_DEADLINE = TIMEOUTS_CONFIG.get("update", 30)
+# Default timeouts (seconds) of single arr requests, by endpoint kind
+ENDPOINT_TIMEOUTS = {
+    "default": TIMEOUTS_CONFIG.get("default", 10),
+    "lookup": TIMEOUTS_CONFIG.get("lookup", 20),
+    "queue": TIMEOUTS_CONFIG.get("queue", 10),
+    "command": TIMEOUTS_CONFIG.get("command", 15),
+    "poster": TIMEOUTS_CONFIG.get("poster", 5),
+}
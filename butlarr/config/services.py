@@ -1,11 +1,29 @@
+import time
+import asyncio
 import importlib
+import httpx
 from loguru import logger
 
 from . import CONFIG
+from .. import metrics
+from ..deadline import ServiceTimeout
+from ..services import ServiceStatus, ServiceUnavailable
+from ..snapshot import ServiceSnapshot
 
 APIS = CONFIG["apis"]
 SERVICES = []
 
+STARTUP_CONFIG = CONFIG.get("startup") or {}
+# Backoff (seconds) between attempts to initialize an unreachable service
+RETRY_MIN_DELAY = STARTUP_CONFIG.get("retry_min_delay", 5)
+RETRY_MAX_DELAY = STARTUP_CONFIG.get("retry_max_delay", 300)
+
+# Errors worth retrying, anything else (e.g. an unsupported api) will not go away
+TRANSIENT_ERRORS = (ServiceUnavailable, ServiceTimeout, httpx.TransportError)
+
+_loading_tasks = []
+_snapshot = None
+
 def _constructor(service_type):
     try:
         service_module = importlib.import_module(f"butlarr.services.{service_type.lower()}")
@@ -53,4 +71,63 @@ def _load_services():
         service.addons = addons
         logger.debug(f"{service.name} service loaded Addons: {str(service.addons)}")
 
-_load_services()
\ No newline at end of file
+_load_services()
+
+
+def _restore_service(service):
+    name = service.name or service.commands[0]
+    snapshot = _snapshot.get(service.snapshot_key)
+    if not snapshot:
+        return False
+    try:
+        service.restore_snapshot(snapshot)
+    except (KeyError, TypeError) as e:
+        logger.warning(f"[Startup] Ignoring invalid snapshot of {name}: {e}")
+        return False
+    service.status = ServiceStatus.READY
+    logger.info(f"[Startup] {name} (v{service.api_version}) ready from snapshot")
+    return True
+
+
+async def _load_service(service, restored):
+    # Keep retrying in the background, the bot answers for the service meanwhile
+    name = service.name or service.commands[0]
+    start = time.perf_counter()
+    delay = RETRY_MIN_DELAY
+    while True:
+        try:
+            await service.load()
+            break
+        except TRANSIENT_ERRORS as e:
+            logger.warning(f"[Startup] {name} unavailable ({e}). Retrying in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, RETRY_MAX_DELAY)
+        except Exception as e:
+            logger.error(f"[Startup] Could not load {name}: {e!r}")
+            return
+
+    service.status = ServiceStatus.READY
+    await asyncio.to_thread(_snapshot.put, service.snapshot_key, service.dump_snapshot())
+    elapsed = time.perf_counter() - start
+    metrics.observe(f"startup.{name}", elapsed)
+    logger.info(
+        f"[Startup] {name} (v{service.api_version}) {'revalidated' if restored else 'ready'} after {elapsed * 1000:.0f}ms"
+    )
+
+
+def load_services():
+    # Probe apis and fetch reference data of all services concurrently, without
+    # holding back polling. Services answer as "starting" until they are ready,
+    # unless they can be served from the last snapshot in the meantime.
+    global _snapshot
+    _snapshot = ServiceSnapshot()
+    for service in SERVICES:
+        restored = _restore_service(service)
+        _loading_tasks.append(asyncio.create_task(_load_service(service, restored)))
+
+
+async def stop_loading_services():
+    for task in _loading_tasks:
+        task.cancel()
+    await asyncio.gather(*_loading_tasks, return_exceptions=True)
+    _loading_tasks.clear()
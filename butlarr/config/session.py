@@ -0,0 +1,13 @@
+from . import CONFIG
+
+SESSION_CONFIG = CONFIG.get("session") or {}
+
+# Number of live session states kept in memory
+SESSION_CACHE_ENTRIES = SESSION_CONFIG.get("cache_entries", 1024)
+# Max seconds changed sessions stay in memory before they are written to disk
+SESSION_FLUSH_DELAY = SESSION_CONFIG.get("flush_delay", 2)
+# Seconds after their last use until sessions expire
+SESSION_TTL = SESSION_CONFIG.get("ttl", 24 * 60 * 60)
+# Seconds between runs of the expired session sweeper, and sessions removed per run
+SESSION_SWEEP_INTERVAL = SESSION_CONFIG.get("sweep_interval", 5 * 60)
+SESSION_SWEEP_BATCH = SESSION_CONFIG.get("sweep_batch", 500)
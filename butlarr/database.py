@@ -1,12 +1,16 @@
 import os
+import queue
+import asyncio
 from pathlib import Path
 from loguru import logger
 import sqlite3
-from threading import Lock
+from threading import Lock, Thread
 
 DEFAULT_PATH = os.path.join(
     Path(os.path.dirname(os.path.realpath(__file__))).parent, "data", "db.sqlite"
 )
+# Max queries waiting for the database thread, further callers wait their turn
+MAX_PENDING = 64
 
 
 def _dict_factory(cursor, row):
@@ -17,34 +21,45 @@ def _dict_factory(cursor, row):
 
 
 class Database:
+    """
+    Users and their auth levels.
+
+    Uses one long-lived connection in WAL mode, shared between threads under
+    `lock`, so repeated queries are served from its statement cache.
+    Auth levels are mirrored in memory and written through, so checking
+    them does not touch the database.
+    """
+
     lock = Lock()
     db_file: Path
     file: str
 
-    def _get_con_cur(self):
-        # Connect to local DB and return tuple containing connection and cursor
+    def _connect(self):
         try:
-            con = sqlite3.connect(self.db_file, timeout=30)
-            con.execute("PRAGMA journal_mode = off;")
+            con = sqlite3.connect(self.db_file, timeout=30, check_same_thread=False)
+            con.execute("PRAGMA journal_mode = wal;")
+            con.execute("PRAGMA synchronous = normal;")
             con.row_factory = _dict_factory
-            cur = con.cursor()
             logger.debug(f"Database connection established [{self.db_file}].")
         except sqlite3.Error as e:
             logger.error(f"Error connecting to database: {e}")
             raise
 
-        return (con, cur)
+        return con
 
     def __init__(self, db_file=DEFAULT_PATH):
         self.db_file = Path(db_file)
         # Make sure the file exists
         self.db_file.parent.mkdir(exist_ok=True, parents=True)
         self.db_file.touch(exist_ok=True)
+        self.con = self._connect()
         # Initialize the db
         self._init_db()
+        # user id -> auth level
+        users = self._execute_query("SELECT id, auth_level FROM users;", fetch="all")
+        self._auth_levels = {r["id"]: r["auth_level"] for r in users}
 
     def _init_db(self):
-        con, cur = self._get_con_cur()
         queries = [
             """CREATE TABLE IF NOT EXISTS users (
                 id integer primary key,
@@ -53,76 +68,131 @@ class Database:
             );""",
         ]
         for q in queries:
-            logger.debug(f"Executing query: [{q}] with no args...")
-            try:
-                with self.lock:
-                    cur.execute(q)
-            except sqlite3.Error as e:
-                logger.error(f"Error executing database query [{q}]: {e}")
-                raise
+            self._execute_query(q, commit=True)
 
-        con.commit()
-        con.close()
-
-    def _execute_query(self, q, qa=()):
-        con, cur = self._get_con_cur()
+    def _execute_query(self, q, qa=(), commit=False, fetch=None):
         logger.debug(f"Executing query: [{q}] with args: [{qa}]")
         try:
             with self.lock:
-                r = cur.execute(q, qa)
-                return (r, con)
+                r = self.con.execute(q, qa)
+                if commit:
+                    self.con.commit()
+                if fetch == "one":
+                    return r.fetchone()
+                if fetch == "all":
+                    return r.fetchall()
+                return r
         except sqlite3.Error as e:
             logger.error(f"Error executing database query [{q}]: {e}")
             raise
 
+    def close(self):
+        with self.lock:
+            self.con.close()
+
     def add_user(self, id, username, auth_level):
         q = "INSERT OR REPLACE INTO users (id, username, auth_level) VALUES (?, ?, ?);"
         qa = (id, username, auth_level)
-        (_, con) = self._execute_query(q, qa)
-        con.commit()
-        con.close()
+        self._execute_query(q, qa, commit=True)
+        self._auth_levels[id] = auth_level
 
     def remove_user(self, id):
         q = "DELETE FROM users where id=?;"
         qa = (id,)
-        (_, con) = self._execute_query(q, qa)
-        con.commit()
-        con.close()
+        self._execute_query(q, qa, commit=True)
+        self._auth_levels.pop(id, None)
 
     def get_users(
         self,
         auth_level=None,
         min_auth_level=None,
     ):
-        auth_check = (
-            f">= {min_auth_level}"
-            if min_auth_level
-            else f"== {auth_level}" if auth_level else ""
-        )
-        q = f"SELECT * FROM users where auth_level {auth_check}"
-        (r, con) = self._execute_query(q)
-        records = r.fetchall() if r else []
+        if min_auth_level:
+            q, qa = "SELECT * FROM users where auth_level >= ?;", (min_auth_level,)
+        elif auth_level:
+            q, qa = "SELECT * FROM users where auth_level == ?;", (auth_level,)
+        else:
+            q, qa = "SELECT * FROM users;", ()
+        records = self._execute_query(q, qa, fetch="all") or []
         logger.debug(f"Found {len(records)} users in the database.")
-        con.close()
         return records
 
     def update_auth_level(self, user_id, auth_level=1):
         q = "UPDATE users set auth_level=? where id=?;"
         qa = (auth_level, user_id)
-        (_, con) = self._execute_query(q, qa)
-        con.commit()
-        con.close()
+        r = self._execute_query(q, qa, commit=True)
+        if r.rowcount:
+            self._auth_levels[user_id] = auth_level
 
     def get_auth_level(self, user_id):
-        q = "SELECT * FROM users WHERE id=?;"
-        qa = (user_id,)
-        (r, con) = self._execute_query(q, qa)
-
-        record = r.fetchone() if r else None
-        logger.debug(f"Query result for user lookup: {record}")
-        con.close()
-        if record and record["id"] == user_id:
-            return record["auth_level"]
-
-        logger.debug(f"Did not find user [{user_id}] in the database.")
-        return None
+        auth_level = self._auth_levels.get(user_id)
+        if auth_level is None:
+            logger.debug(f"Did not find user [{user_id}] in the database.")
+        return auth_level
+
+
+class AsyncDatabase:
+    """
+    Awaitable facade of `Database` for use on the event loop.
+
+    Queries run one after another on a dedicated thread, with at most
+    `max_pending` of them queued, so lock waits and disk latency never block
+    update processing. Auth levels are answered from memory right away.
+    """
+
+    def __init__(self, db: Database, max_pending: int = MAX_PENDING):
+        self.db = db
+        self._slots = asyncio.Semaphore(max_pending)
+        self._queue = queue.Queue()
+        self._thread = Thread(target=self._work, name="butlarr-db", daemon=True)
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            func, args, future, loop = job
+            try:
+                result = func(*args)
+                loop.call_soon_threadsafe(_set_result, future, result)
+            except Exception as e:
+                loop.call_soon_threadsafe(_set_exception, future, e)
+
+    async def _run(self, func, *args):
+        async with self._slots:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._queue.put((func, args, future, loop))
+            return await future
+
+    async def add_user(self, id, username, auth_level):
+        return await self._run(self.db.add_user, id, username, auth_level)
+
+    async def remove_user(self, id):
+        return await self._run(self.db.remove_user, id)
+
+    async def get_users(self, auth_level=None, min_auth_level=None):
+        return await self._run(self.db.get_users, auth_level, min_auth_level)
+
+    async def update_auth_level(self, user_id, auth_level=1):
+        return await self._run(self.db.update_auth_level, user_id, auth_level)
+
+    async def get_auth_level(self, user_id):
+        return self.db.get_auth_level(user_id)
+
+    async def close(self):
+        # Finish the queued queries, then stop the thread
+        await self._run(self.db.close)
+        self._queue.put(None)
+        await asyncio.to_thread(self._thread.join)
+
+
+def _set_result(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _set_exception(future, e):
+    if not future.done():
+        future.set_exception(e)
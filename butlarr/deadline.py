@@ -0,0 +1,42 @@
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from .config.http import UPDATE_DEADLINE
+
+# Monotonic point in time until which the current update may wait on services
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+class ServiceTimeout(Exception):
+    def __init__(self, service_name: str):
+        self.service_name = service_name
+        super().__init__(
+            f"{service_name} is responding slowly. Please try again in a moment."
+        )
+
+
+@contextmanager
+def deadline(budget: float = UPDATE_DEADLINE):
+    token = _deadline.set(time.monotonic() + budget)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    current = _deadline.get()
+    if current is None:
+        return None
+    return current - time.monotonic()
+
+
+def request_timeout(default: float) -> float:
+    # Clamp a single request's timeout to what is left of the update's budget
+    left = remaining()
+    if left is None:
+        return default
+    return min(default, left)
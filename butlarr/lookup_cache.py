@@ -0,0 +1,187 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import asyncio
+import unicodedata
+
+from pathlib import Path
+from loguru import logger
+from threading import Lock
+from typing import Any, List, Optional
+
+from .cache import LRUCache
+from .backend import RedisBackend
+from .config.cache import (
+    LOOKUP_TTL,
+    LOOKUP_NEGATIVE_TTL,
+    LOOKUP_MEMORY_SIZE,
+    LOOKUP_DISK_ENTRIES,
+)
+
+DEFAULT_PATH = os.path.join(
+    Path(os.path.dirname(os.path.realpath(__file__))).parent,
+    "data",
+    "lookup_cache.sqlite",
+)
+
+# Fields identifying the same media item across lookups
+ITEM_ID_FIELDS = ["tvdbId", "tmdbId", "imdbId"]
+
+
+def normalize_term(term: str) -> str:
+    term = unicodedata.normalize("NFKC", term).casefold()
+    return re.sub(r"\s+", " ", term).strip()
+
+
+def _item_keys(item) -> List[str]:
+    return [f"{f}:{item[f]}" for f in ITEM_ID_FIELDS if item.get(f)]
+
+
+def _ids_column(results) -> str:
+    keys = {k for item in results for k in _item_keys(item)}
+    return "," + ",".join(sorted(keys)) + ","
+
+
+class LookupCache:
+    """
+    Two tier cache of lookup (search) results per service and normalized term.
+
+    Results are kept serialized, in a size bounded in-memory LRU backed by a
+    small sqlite store, so they survive restarts. Empty results are cached
+    with a shorter ttl. With a shared `backend`, it replaces the sqlite store,
+    so all instances share their lookups, and is read on every access
+    instead of being fronted by the in-memory LRU.
+    """
+
+    lock = Lock()
+    db_file: Path
+
+    def __init__(
+        self,
+        db_file=DEFAULT_PATH,
+        ttl: float = LOOKUP_TTL,
+        negative_ttl: float = LOOKUP_NEGATIVE_TTL,
+        memory_size: int = LOOKUP_MEMORY_SIZE,
+        disk_entries: int = LOOKUP_DISK_ENTRIES,
+        backend: Optional[RedisBackend] = None,
+    ):
+        self.db_file = Path(db_file)
+        self.backend = backend
+        if backend:
+            # Other instances may invalidate any lookup, so always read the backend
+            memory_size = 0
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.disk_entries = disk_entries
+        # key -> (expires_at, serialized results, ids column)
+        self.memory = LRUCache(max_size=memory_size, sizeof=lambda e: len(e[1]))
+        self._con = None
+
+    def _get_con(self):
+        if self._con is None:
+            self.db_file.parent.mkdir(exist_ok=True, parents=True)
+            self._con = sqlite3.connect(self.db_file, check_same_thread=False)
+            self._con.execute("PRAGMA journal_mode = wal;")
+            self._con.execute(
+                """CREATE TABLE IF NOT EXISTS lookups (
+                    namespace text not null,
+                    term text not null,
+                    results text not null,
+                    ids text not null,
+                    expires_at real not null,
+                    primary key (namespace, term)
+                );"""
+            )
+        return self._con
+
+    async def get(self, namespace: str, term: str) -> Optional[List[Any]]:
+        key = (namespace, normalize_term(term))
+        now = time.time()
+
+        entry = self.memory.get(key)
+        if entry and entry[0] > now:
+            logger.debug(f"Lookup cache hit (memory) for {key}")
+            return json.loads(entry[1])
+
+        entry = await asyncio.to_thread(self._disk_get, key, now)
+        if entry:
+            logger.debug(f"Lookup cache hit (disk) for {key}")
+            self.memory.put(key, entry)
+            return json.loads(entry[1])
+        return None
+
+    async def put(self, namespace: str, term: str, results: List[Any]):
+        key = (namespace, normalize_term(term))
+        ttl = self.ttl if results else self.negative_ttl
+        entry = (time.time() + ttl, json.dumps(results), _ids_column(results))
+        self.memory.put(key, entry)
+        await asyncio.to_thread(self._disk_put, key, entry)
+
+    async def invalidate(self, namespace: str, item):
+        # Drop every cached lookup containing the item, as its library state changed
+        keys = _item_keys(item)
+        for key, (_, _, ids) in self.memory.items():
+            if key[0] == namespace and any(f",{k}," in ids for k in keys):
+                self.memory.pop(key)
+        await asyncio.to_thread(self._disk_invalidate, namespace, keys)
+
+    def _disk_get(self, key, now):
+        if self.backend:
+            data = self.backend.get(self.backend.key("lookup", *key))
+            return tuple(json.loads(data)) if data is not None else None
+        with self.lock:
+            r = self._get_con().execute(
+                "SELECT expires_at, results, ids FROM lookups WHERE namespace=? AND term=? AND expires_at>?;",
+                (*key, now),
+            )
+            return r.fetchone()
+
+    def _disk_put(self, key, entry):
+        if self.backend:
+            self._remote_put(key, entry)
+            return
+        with self.lock:
+            con = self._get_con()
+            try:
+                con.execute(
+                    "INSERT OR REPLACE INTO lookups (namespace, term, results, ids, expires_at) VALUES (?, ?, ?, ?, ?);",
+                    (*key, entry[1], entry[2], entry[0]),
+                )
+                con.execute("DELETE FROM lookups WHERE expires_at<=?;", (time.time(),))
+                con.execute(
+                    "DELETE FROM lookups WHERE rowid NOT IN (SELECT rowid FROM lookups ORDER BY expires_at DESC LIMIT ?);",
+                    (self.disk_entries,),
+                )
+                con.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Error writing lookup cache: {e}")
+
+    def _remote_put(self, key, entry):
+        # Expiry is left to the server, the item ids map to the lookups containing them
+        ttl_ms = max(int((entry[0] - time.time()) * 1000), 1)
+        lookup_key = self.backend.key("lookup", *key)
+        pipe = self.backend.pipeline()
+        pipe.set(lookup_key, json.dumps(entry), px=ttl_ms)
+        for k in entry[2].strip(",").split(","):
+            if k:
+                ids_key = self.backend.key("lookup-ids", key[0], k)
+                pipe.sadd(ids_key, lookup_key)
+                pipe.pexpire(ids_key, ttl_ms)
+        pipe.execute()
+
+    def _disk_invalidate(self, namespace, keys):
+        if self.backend:
+            ids_keys = [self.backend.key("lookup-ids", namespace, k) for k in keys]
+            lookup_keys = {m for ids_key in ids_keys for m in self.backend.members(ids_key)}
+            self.backend.delete([*lookup_keys, *ids_keys])
+            return
+        with self.lock:
+            con = self._get_con()
+            for k in keys:
+                con.execute(
+                    "DELETE FROM lookups WHERE namespace=? AND ids LIKE ?;",
+                    (namespace, f"%,{k},%"),
+                )
+            con.commit()
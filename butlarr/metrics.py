@@ -0,0 +1,43 @@
+from collections import Counter
+from threading import Lock
+from typing import Dict
+from loguru import logger
+
+lock = Lock()
+_counters: Counter = Counter()
+# name -> [count, total seconds, max seconds]
+_timings: Dict[str, list] = {}
+
+
+def incr(name: str, value: int = 1):
+    with lock:
+        _counters[name] += value
+
+
+def observe(name: str, seconds: float):
+    with lock:
+        timing = _timings.setdefault(name, [0, 0.0, 0.0])
+        timing[0] += 1
+        timing[1] += seconds
+        timing[2] = max(timing[2], seconds)
+
+
+def snapshot():
+    with lock:
+        return {
+            "counters": dict(_counters),
+            "timings": {
+                name: {"count": c, "avg": total / c, "max": max_}
+                for name, (c, total, max_) in _timings.items()
+            },
+        }
+
+
+def log_snapshot():
+    metrics = snapshot()
+    for name, value in sorted(metrics["counters"].items()):
+        logger.info(f"[Metrics] {name}: {value}")
+    for name, t in sorted(metrics["timings"].items()):
+        logger.info(
+            f"[Metrics] {name}: {t['count']} calls, avg {t['avg'] * 1000:.1f}ms, max {t['max'] * 1000:.1f}ms"
+        )
@@ -0,0 +1,271 @@
+import io
+import os
+import time
+import httpx
+import sqlite3
+import asyncio
+import hashlib
+import contextvars
+
+from pathlib import Path
+from loguru import logger
+from threading import Lock
+from typing import Iterable, Optional
+
+from .cache import LRUCache
+from .deadline import request_timeout
+from .services.transport import get_client
+from .config.http import ENDPOINT_TIMEOUTS
+from .config.cache import (
+    POSTER_ENTRIES,
+    POSTER_NEGATIVE_TTL,
+    POSTER_DISK_SIZE,
+    POSTER_MAX_WIDTH,
+    POSTER_PREFETCH_CONCURRENCY,
+)
+
+DATA_PATH = os.path.join(
+    Path(os.path.dirname(os.path.realpath(__file__))).parent, "data"
+)
+DEFAULT_PATH = os.path.join(DATA_PATH, "poster_cache.sqlite")
+DEFAULT_POSTER_PATH = os.path.join(DATA_PATH, "posters")
+
+
+class PosterCache:
+    """
+    Telegram file ids of posters already sent, per poster url, so later sends
+    reuse the uploaded photo instead of Telegram fetching the url again.
+    Urls Telegram failed to fetch are remembered for `negative_ttl` seconds.
+
+    All entries are loaded into memory on startup and written through to a
+    small sqlite store.
+    """
+
+    lock = Lock()
+    db_file: Path
+
+    def __init__(
+        self,
+        db_file=DEFAULT_PATH,
+        max_entries: int = POSTER_ENTRIES,
+        negative_ttl: float = POSTER_NEGATIVE_TTL,
+    ):
+        self.db_file = Path(db_file)
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        # url -> file id
+        self.memory = LRUCache(max_entries=max_entries)
+        # url -> failed until
+        self._failed = {}
+        self._con = None
+
+    def _get_con(self):
+        if self._con is None:
+            self.db_file.parent.mkdir(exist_ok=True, parents=True)
+            self._con = sqlite3.connect(self.db_file, check_same_thread=False)
+            self._con.execute("PRAGMA journal_mode = wal;")
+            self._con.execute(
+                """CREATE TABLE IF NOT EXISTS posters (
+                    url text primary key,
+                    file_id text,
+                    failed_until real,
+                    updated_at real not null
+                );"""
+            )
+            records = self._con.execute(
+                "SELECT url, file_id, failed_until FROM posters ORDER BY updated_at LIMIT ?;",
+                (self.max_entries,),
+            )
+            for url, file_id, failed_until in records:
+                if file_id:
+                    self.memory.put(url, file_id)
+                elif failed_until:
+                    self._failed[url] = failed_until
+        return self._con
+
+    def load(self):
+        with self.lock:
+            self._get_con()
+
+    def get(self, url: str) -> Optional[str]:
+        return self.memory.get(url)
+
+    def failed(self, url: str) -> bool:
+        failed_until = self._failed.get(url)
+        if failed_until and failed_until < time.time():
+            del self._failed[url]
+            return False
+        return bool(failed_until)
+
+    async def put(self, url: str, file_id: str):
+        self.memory.put(url, file_id)
+        self._failed.pop(url, None)
+        await asyncio.to_thread(self._disk_put, url, file_id, None)
+
+    async def put_failed(self, url: str):
+        self.memory.pop(url)
+        failed_until = time.time() + self.negative_ttl
+        self._failed[url] = failed_until
+        await asyncio.to_thread(self._disk_put, url, None, failed_until)
+
+    async def forget(self, url: str):
+        # Drop a file id that Telegram no longer accepts
+        self.memory.pop(url)
+        await asyncio.to_thread(self._disk_forget, url)
+
+    def _disk_forget(self, url):
+        with self.lock:
+            con = self._get_con()
+            try:
+                con.execute("DELETE FROM posters WHERE url=?;", (url,))
+                con.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Error writing poster cache: {e}")
+
+    def _disk_put(self, url, file_id, failed_until):
+        now = time.time()
+        with self.lock:
+            con = self._get_con()
+            try:
+                con.execute(
+                    "INSERT OR REPLACE INTO posters (url, file_id, failed_until, updated_at) VALUES (?, ?, ?, ?);",
+                    (url, file_id, failed_until, now),
+                )
+                con.execute(
+                    "DELETE FROM posters WHERE rowid NOT IN (SELECT rowid FROM posters ORDER BY updated_at DESC LIMIT ?);",
+                    (self.max_entries,),
+                )
+                con.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Error writing poster cache: {e}")
+
+
+poster_cache = PosterCache()
+
+
+def downscale(data: bytes, max_width: int) -> bytes:
+    # Shrink to max_width as jpeg, if Pillow is installed
+    try:
+        from PIL import Image
+    except ImportError:
+        return data
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            if image.width <= max_width and image.format == "JPEG":
+                return data
+            image.thumbnail((max_width, max_width * 3))
+            out = io.BytesIO()
+            image.convert("RGB").save(out, format="JPEG", quality=85, optimize=True)
+            return out.getvalue()
+    except Exception as e:
+        logger.warning(f"Could not downscale poster: {e}")
+        return data
+
+
+class PosterStore:
+    """
+    Downscaled posters on local disk, so they can be uploaded directly
+    instead of Telegram fetching the full size artwork from upstream.
+    Bounded by total size, evicting the least recently used posters.
+    """
+
+    def __init__(
+        self,
+        path=DEFAULT_POSTER_PATH,
+        max_size: int = POSTER_DISK_SIZE,
+        max_width: int = POSTER_MAX_WIDTH,
+        concurrency: int = POSTER_PREFETCH_CONCURRENCY,
+    ):
+        self.path = Path(path)
+        self.max_width = max_width
+        # file name -> bytes on disk
+        self.index = LRUCache(
+            max_size=max_size, sizeof=lambda size: size, on_evict=self._remove
+        )
+        self._fetching = {}
+        self._slots = asyncio.Semaphore(concurrency)
+
+    def load(self):
+        self.path.mkdir(exist_ok=True, parents=True)
+        files = sorted(self.path.glob("*.jpg"), key=lambda f: f.stat().st_mtime)
+        for file in files:
+            self.index.put(file.name, file.stat().st_size)
+
+    def _file_name(self, url: str) -> str:
+        return hashlib.sha1(url.encode()).hexdigest() + ".jpg"
+
+    def _remove(self, name, _size):
+        try:
+            (self.path / name).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _read(self, name) -> Optional[bytes]:
+        try:
+            return (self.path / name).read_bytes()
+        except FileNotFoundError:
+            self.index.pop(name)
+            return None
+
+    def _write(self, name, data: bytes):
+        file = self.path / name
+        tmp_file = file.with_suffix(".tmp")
+        tmp_file.write_bytes(data)
+        tmp_file.replace(file)
+
+    async def get(self, url: str) -> Optional[bytes]:
+        # Poster from disk, or fetched now; None if it could not be fetched
+        name = self._file_name(url)
+        if name in self.index:
+            self.index.get(name)
+            data = await asyncio.to_thread(self._read, name)
+            if data is not None:
+                return data
+        # Join a running prefetch of the same poster
+        task = self._fetching.get(name)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(url, name))
+            self._fetching[name] = task
+            task.add_done_callback(lambda _: self._fetching.pop(name, None))
+        return await asyncio.shield(task)
+
+    async def _fetch(self, url: str, name: str) -> Optional[bytes]:
+        try:
+            r = await get_client(url).get(
+                url,
+                timeout=request_timeout(ENDPOINT_TIMEOUTS["poster"]),
+                follow_redirects=True,
+            )
+        except httpx.HTTPError as e:
+            logger.debug(f"Could not fetch poster [{url}]: {e}")
+            return None
+        if not r.is_success:
+            logger.debug(f"Could not fetch poster [{url}]: {r.status_code}")
+            return None
+        data = await asyncio.to_thread(downscale, r.content, self.max_width)
+        try:
+            await asyncio.to_thread(self._write, name, data)
+        except OSError as e:
+            logger.warning(f"Could not store poster [{url}]: {e}")
+            return data
+        self.index.put(name, len(data))
+        return data
+
+    def prefetch(self, urls: Iterable[str]):
+        # Fetch posters likely shown next in the background
+        for url in filter(None, urls):
+            name = self._file_name(url)
+            if name not in self.index and name not in self._fetching:
+                # Outside of the update's context, so its deadline does not apply
+                task = asyncio.get_running_loop().create_task(
+                    self._prefetch(url, name), context=contextvars.Context()
+                )
+                self._fetching[name] = task
+                task.add_done_callback(lambda _, name=name: self._fetching.pop(name, None))
+
+    async def _prefetch(self, url: str, name: str):
+        async with self._slots:
+            return await self._fetch(url, name)
+
+
+poster_store = PosterStore()
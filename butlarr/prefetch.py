@@ -0,0 +1,63 @@
+import asyncio
+import contextvars
+
+from loguru import logger
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List
+
+from .config.cache import PREFETCH_CONCURRENCY
+
+Job = Callable[[], Awaitable[Any]]
+
+
+class Prefetcher:
+    """
+    Runs requests likely needed by the next update of a session in the
+    background, at most `concurrency` at once across all sessions.
+
+    Each session has at most one round of jobs running. Scheduling a new
+    round, or cancelling the session, cancels the jobs of the previous one.
+    A cancelled job keeps its slot until its request has stopped, requests
+    shared with an update keep running for it (see `SingleFlight`).
+    Failing jobs are only logged, the update itself will retry them.
+    """
+
+    def __init__(self, concurrency: int = PREFETCH_CONCURRENCY):
+        self._slots = asyncio.Semaphore(concurrency)
+        self._tasks: Dict[Hashable, asyncio.Task] = {}
+
+    def schedule(self, key: Hashable, jobs: Iterable[Job]):
+        self.cancel(key)
+        jobs = list(jobs)
+        if not jobs:
+            return
+        # Outside of the update's context, so its deadline does not apply
+        task = asyncio.get_running_loop().create_task(
+            self._run(jobs), context=contextvars.Context()
+        )
+        self._tasks[key] = task
+        task.add_done_callback(lambda t: self._done(key, t))
+
+    def cancel(self, key: Hashable):
+        task = self._tasks.pop(key, None)
+        if task and not task.done():
+            logger.debug(f"Cancelling prefetch of {key}")
+            task.cancel()
+
+    async def _run(self, jobs: List[Job]):
+        await asyncio.gather(*(self._job(job) for job in jobs))
+
+    async def _job(self, job: Job):
+        async with self._slots:
+            try:
+                await job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"Prefetch failed: {e}")
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+
+prefetcher = Prefetcher()
@@ -0,0 +1,183 @@
+import uuid
+import asyncio
+
+from dataclasses import replace
+
+from loguru import logger
+from typing import Any, List, Optional, Sequence, Tuple
+
+from .cache import LRUCache
+from .backend import RedisBackend, get_backend
+from .session_codec import register_reference, encode, decode, SessionDecodeError
+from .config.cache import RESULT_STORE_ITEMS
+from .config.session import SESSION_TTL
+
+
+class ResultStore:
+    """
+    Shared in-memory store of full lookup/library results, bounded by the
+    total number of items. Sessions only keep a ResultSet referencing them.
+
+    With a shared backend, results are also written there (expiring with
+    the sessions), so other instances can serve callbacks on them. Reading
+    them renews their expiry, as their session is in use.
+    """
+
+    def __init__(
+        self,
+        max_items: int = RESULT_STORE_ITEMS,
+        backend: Optional[RedisBackend] = None,
+        ttl: float = SESSION_TTL,
+    ):
+        self.cache = LRUCache(max_size=max_items)
+        self.backend = backend
+        self.ttl = ttl
+
+    async def put(self, items: List[Any], key: Optional[str] = None) -> str:
+        key = key or uuid.uuid4().hex
+        self.cache.put(key, items)
+        if self.backend:
+            await asyncio.to_thread(
+                self.backend.set,
+                self.backend.key("results", key),
+                encode(items),
+                self.ttl,
+            )
+        return key
+
+    async def get(self, key: str) -> Optional[List[Any]]:
+        items = self.cache.get(key)
+        if self.backend:
+            backend_key = self.backend.key("results", key)
+            if items is not None:
+                await asyncio.to_thread(self.backend.expire, backend_key, self.ttl)
+                return items
+            data = await asyncio.to_thread(self.backend.get, backend_key, self.ttl)
+            if data is not None:
+                try:
+                    items = decode(data)
+                except SessionDecodeError as e:
+                    # Refetched by the session, as if the results had expired
+                    logger.warning(f"Dropping undecodable results {key}: {e}")
+                    return None
+                self.cache.put(key, items)
+        return items
+
+
+result_store = ResultStore(backend=get_backend())
+
+# Fields identifying an item across refetches, before and after it was added
+ITEM_ID_FIELDS = ("tvdbId", "tmdbId", "id")
+
+
+def item_id(item) -> Optional[str]:
+    for field in ITEM_ID_FIELDS:
+        if item.get(field):
+            return f"{field}:{item[field]}"
+    return None
+
+
+class ResultSet(Sequence):
+    """
+    Sequence of results, of which only a reference and the item ids are persisted.
+
+    Pickles to its store key, the source it was fetched from and the ids of
+    its items. If the items have been evicted from the store, `hydrate`
+    refetches them from the source and restores their order by id, dropping
+    items that are gone upstream.
+    """
+
+    key: str
+    source: Tuple
+    ids: Optional[List[Optional[str]]]
+    length: int
+
+    def __init__(self, key: str, items: List[Any], source: Tuple):
+        self.key = key
+        self.source = source
+        self.ids = [item_id(item) for item in items]
+        self.length = len(items)
+        self._items = items
+
+    @classmethod
+    async def create(cls, items: List[Any], source: Tuple) -> "ResultSet":
+        return cls(await result_store.put(items), items, source)
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        if self._items is None:
+            self._items = result_store.cache.get(self.key)
+        assert self._items is not None, "ResultSet accessed before being hydrated!"
+        return self._items[index]
+
+    def id_at(self, index: int) -> Optional[str]:
+        if self.ids is None or not 0 <= index < len(self.ids):
+            return None
+        return self.ids[index]
+
+    def __getstate__(self):
+        return {"key": self.key, "source": self.source, "ids": self.ids}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # Written before ids were kept, only the length is known
+        self.ids = state.get("ids")
+        self.length = len(self.ids) if self.ids is not None else state["length"]
+        self._items = None
+
+    async def hydrate(self, service) -> bool:
+        # Returns whether the items had to be refetched
+        if self._items is not None:
+            return False
+        self._items = await result_store.get(self.key)
+        if self._items is not None:
+            return False
+
+        logger.debug(f"Results {self.key} were evicted, refetching {self.source}")
+        items = await service.load_results(self.source)
+        if self.ids is None:
+            self._items = items[: self.length]
+        else:
+            by_id = {item_id(item): item for item in items}
+            by_id.pop(None, None)
+            self.ids = [id for id in self.ids if id in by_id]
+            self._items = [by_id[id] for id in self.ids]
+        self.length = len(self._items)
+        await result_store.put(self._items, key=self.key)
+        return True
+
+
+async def hydrate_state(service, state):
+    """
+    Loads the results referenced by a session state.
+
+    Returns the state with its index following the selected item, or None
+    if the selected item could not be found again after a refetch.
+    """
+    items = getattr(state, "items", None)
+    if isinstance(items, ResultSet):
+        selected = items.id_at(state.index)
+        if await items.hydrate(service) and items.ids is not None:
+            if selected not in items.ids:
+                logger.info(f"Selected item {selected} of {items.source} is gone")
+                return None
+            state = replace(state, index=items.ids.index(selected))
+    # Addon states carry the state of the service they were opened from
+    parent = getattr(state, "parent", None)
+    if parent and parent.state:
+        parent_state = await hydrate_state(parent.service, parent.state)
+        if parent_state is None:
+            return None
+        state = replace(state, parent=replace(parent, state=parent_state))
+    return state
+
+
+def _restore_result_set(state):
+    result_set = ResultSet.__new__(ResultSet)
+    result_set.__setstate__(state)
+    return result_set
+
+
+register_reference(ResultSet, "ResultSet", ResultSet.__getstate__, _restore_result_set)
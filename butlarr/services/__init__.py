@@ -1,10 +1,26 @@
-import requests
+import time
+import httpx
+
 from dataclasses import dataclass
 from loguru import logger
 from enum import Enum
 from typing import List, Tuple, Optional, Any
 from ..tg_handler import TelegramHandler
 from ..session_database import SessionDatabase
+from ..lookup_cache import LookupCache
+from ..backend import get_backend
+# Module import, as the poster cache itself imports from this package
+from .. import poster_cache as posters
+from ..session_codec import register_reference
+from ..cache import LRUCache
+from ..prefetch import prefetcher
+from ..tg_handler.session_state import search_key
+from .transport import get_client, SingleFlight
+from .. import metrics
+from .reference import ReferenceData
+from ..config.http import ENDPOINT_TIMEOUTS
+from ..config.cache import PREFETCH_TTL, PREFETCH_ENTRIES
+from ..deadline import ServiceTimeout, request_timeout
 
 
 def is_int(value):
@@ -26,6 +42,21 @@ def find_first(elems, check, fallback=0):
         return result
 
 
+def get_service(command: str):
+    from ..config.services import SERVICES
+
+    return next(s for s in SERVICES if s.commands[0] == command)
+
+
+class ServiceUnavailable(Exception):
+    pass
+
+
+class ServiceStatus(Enum):
+    WARMING = "warming"
+    READY = "ready"
+
+
 class Action(Enum):
     GET = "get"
     POST = "post"
@@ -46,8 +77,12 @@ class ArrVariant(Enum):
     BAZARR = "subtitles"
 
 
+register_reference(ArrVariant, "ArrVariant", lambda v: v.value, ArrVariant)
+
+
 class ArrService(TelegramHandler):
     name: str
+    api_host: str
     api_url: str
     api_key: str
     api_version: str
@@ -55,78 +90,223 @@ class ArrService(TelegramHandler):
     arr_variant: ArrVariant | str = None
     addons: []
 
-    root_folders: List[str] = []
+    status: ServiceStatus = ServiceStatus.WARMING
+    reference: ReferenceData
     session_db: SessionDatabase = SessionDatabase()
-
-    def _post(self, endpoint, params={}):
-        return requests.post(
-            f"{self.api_url}/{endpoint}", params={"apikey": self.api_key}, json=params
+    lookup_cache: LookupCache = LookupCache(backend=get_backend())
+    in_flight: SingleFlight = SingleFlight()
+    # Request key -> (expiry, response) of GETs made ahead of the next update
+    prefetched: LRUCache = LRUCache(max_entries=PREFETCH_ENTRIES)
+
+    def __reduce__(self):
+        # Services are referenced (e.g. from session states) by their command
+        return (get_service, (self.commands[0],))
+
+    @property
+    def root_folders(self) -> List[Any]:
+        return self.reference.list("rootfolder")
+
+    @property
+    def quality_profiles(self) -> List[Any]:
+        return self.reference.list("qualityprofile")
+
+    @property
+    def language_profiles(self) -> List[Any]:
+        return self.reference.list("languageprofile")
+
+    def _post(self, endpoint, params={}, timeout=None):
+        return get_client(self.api_url).post(
+            f"{self.api_url}/{endpoint}",
+            params={"apikey": self.api_key},
+            json=params,
+            timeout=timeout,
         )
 
-    def _put(self, endpoint, params={}):
-        return requests.put(
-            f"{self.api_url}/{endpoint}", params={"apikey": self.api_key}, json=params
+    def _put(self, endpoint, params={}, timeout=None):
+        return get_client(self.api_url).put(
+            f"{self.api_url}/{endpoint}",
+            params={"apikey": self.api_key},
+            json=params,
+            timeout=timeout,
         )
 
-    def _get(self, endpoint, params={}):
-        return requests.get(
-            f"{self.api_url}/{endpoint}", params={"apikey": self.api_key, **params}
+    def _get(self, endpoint, params={}, timeout=None):
+        return get_client(self.api_url).get(
+            f"{self.api_url}/{endpoint}",
+            params={"apikey": self.api_key, **params},
+            timeout=timeout,
         )
 
-    def _delete(self, endpoint, params={}):
-        return requests.delete(
-            f"{self.api_url}/{endpoint}", params={"apikey": self.api_key, **params}
+    def _delete(self, endpoint, params={}, timeout=None):
+        return get_client(self.api_url).delete(
+            f"{self.api_url}/{endpoint}",
+            params={"apikey": self.api_key, **params},
+            timeout=timeout,
         )
 
-    def request(self, endpoint: str, *, action=Action.GET, params={}, fallback=None, raw=False):
+    def _endpoint_timeout(self, endpoint: str) -> float:
+        if endpoint.endswith("lookup"):
+            return ENDPOINT_TIMEOUTS["lookup"]
+        if endpoint.startswith("queue"):
+            return ENDPOINT_TIMEOUTS["queue"]
+        if endpoint.startswith("command"):
+            return ENDPOINT_TIMEOUTS["command"]
+        return ENDPOINT_TIMEOUTS["default"]
+
+    async def request(self, endpoint: str, *, action=Action.GET, params={}, fallback=None, raw=False):
         if raw and fallback:
             assert False, "Request response cannot be raw and have a fallback!"
 
+        timeout = request_timeout(self._endpoint_timeout(endpoint))
+        if timeout <= 0:
+            logger.warning(f"Update deadline exceeded before requesting {endpoint}")
+            raise ServiceTimeout(self.name or type(self).__name__)
+
         r = None
-        if action == Action.GET:
-            r = self._get(endpoint, params)
-        elif action == Action.POST:
-            r = self._post(endpoint, params)
-        elif action == Action.PUT:
-            r = self._put(endpoint, params)
-        elif action == Action.DELETE:
-            r = self._delete(endpoint, params)
+        metrics.incr(f"arr.requests.{action.value}")
+        try:
+            if action == Action.GET:
+                key = self._request_key(endpoint, params)
+                r = self._get_prefetched(key)
+                if r is None:
+                    # Identical concurrent GETs share one response
+                    r = await self.in_flight.do(
+                        key, lambda: self._get(endpoint, params, timeout)
+                    )
+            elif action == Action.POST:
+                r = await self._post(endpoint, params, timeout)
+            elif action == Action.PUT:
+                r = await self._put(endpoint, params, timeout)
+            elif action == Action.DELETE:
+                r = await self._delete(endpoint, params, timeout)
+        except httpx.TimeoutException as e:
+            logger.warning(f"Request to {endpoint} timed out after {timeout:.1f}s: {e}")
+            raise ServiceTimeout(self.name or type(self).__name__)
+
+        if action != Action.GET:
+            # Changes may affect any prefetched response
+            self.prefetched.clear()
 
         logger.debug(r.content)
 
         if raw:
             return r
 
-        if not r:
+        if not r.is_success:
             return fallback
 
         if action != Action.DELETE:
             return r.json()
         return r
 
-    def detect_api(self, api_host):
-        status = None
+    def _request_key(self, endpoint: str, params={}):
+        return (
+            self.api_url,
+            self.api_key,
+            endpoint,
+            tuple(sorted((k, str(v)) for k, v in params.items())),
+        )
+
+    def _get_prefetched(self, key):
+        entry = self.prefetched.get(key)
+        if entry is None:
+            return None
+        expires_at, r = entry
+        if time.monotonic() > expires_at:
+            self.prefetched.pop(key)
+            return None
+        metrics.incr("arr.requests.prefetched")
+        return r
+
+    def seed_prefetched(self, endpoint: str, value, params={}):
+        # Serve a GET from data already contained in another response
+        key = self._request_key(endpoint, params)
+        response = httpx.Response(200, json=value)
+        self.prefetched.put(key, (time.monotonic() + PREFETCH_TTL, response))
+
+    async def prefetch_request(self, endpoint: str, params={}):
+        # GET a response ahead of time, to be reused by `request` for a while
+        key = self._request_key(endpoint, params)
+        r = self._get_prefetched(key)
+        if r is None:
+            timeout = self._endpoint_timeout(endpoint)
+            r = await self.in_flight.do(
+                key, lambda: self._get(endpoint, params, timeout)
+            )
+            if r.is_success:
+                self.prefetched.put(key, (time.monotonic() + PREFETCH_TTL, r))
+        return r.json() if r.is_success else None
+
+    async def load(self):
+        raise NotImplementedError
+
+    def is_ready(self):
+        return self.status == ServiceStatus.READY
+
+    @property
+    def snapshot_key(self):
+        return f"{type(self).__name__}:{self.commands[0]}:{self.api_host}"
+
+    def dump_snapshot(self):
+        return {
+            "api_url": self.api_url,
+            "api_version": self.api_version,
+            "reference": self.reference.dump(),
+        }
+
+    def restore_snapshot(self, snapshot):
+        self.api_url = snapshot["api_url"]
+        self.api_version = snapshot["api_version"]
+        self.reference.restore(snapshot.get("reference", {}))
+
+    async def detect_api(self, api_host):
         # Detect version and api_url
-        try:
-            self.api_url = f"{api_host.rstrip('/')}/api/v3"
-            status = self.request("system/status")
-            if not status:
-                self.api_url = f"{api_host.rstrip('/')}/api"
-                status = self.request("system/status")
-                assert not status, "By default only v3 ArrServices are supported"
-        finally:
-            if status is None:
-                logger.error(
-                    f"Could not reach compatible api. Is the service ({self.api_url}) down? Is your API key correct?"
-                )
-                exit(1)
-            assert (
-                status
-            ), "Could not reach compatible api. Is the service down? Is your API key correct?"
-            api_version = status.get("version", "")
-            assert api_version, "Could not find compatible api."
-            return api_version
+        self.api_url = f"{api_host.rstrip('/')}/api/v3"
+        status = await self.request("system/status")
+        if not status:
+            self.api_url = f"{api_host.rstrip('/')}/api"
+            status = await self.request("system/status")
+            assert not status, "By default only v3 ArrServices are supported"
+
+        if not status:
+            raise ServiceUnavailable(
+                f"Could not reach a compatible api at {self.api_url}. Is the service down? Is your API key correct?"
+            )
+        api_version = status.get("version", "")
+        assert api_version, "Could not find compatible api."
+        return api_version
     
+    def get_poster_url(self, item):
+        cover_url = item.get("remotePoster")
+        if not cover_url and item.get("images"):
+            cover_url = item.get("images")[0]["remoteUrl"]
+        return cover_url
+
+    def prefetch(self, state):
+        # Warm what the next tap on this search likely needs, replacing
+        # the previous round of this search
+        self.prefetch_posters(state)
+        prefetcher.schedule(search_key(self), self.prefetch_jobs(state))
+
+    def prefetch_jobs(self, state) -> List[Any]:
+        # Jobs for the `Prefetcher`, to be overridden by services
+        return []
+
+    def prefetch_posters(self, state):
+        # Fetch posters of the neighbouring items in the background
+        urls = [
+            self.get_poster_url(state.items[i])
+            for i in (state.index - 1, state.index + 1)
+            if 0 <= i < len(state.items)
+        ]
+        posters.poster_store.prefetch(
+            url
+            for url in urls
+            if url
+            and not posters.poster_cache.get(url)
+            and not posters.poster_cache.failed(url)
+        )
+
     def get_media_caption(self, item, overview=True):
         caption = f"{item['title']} "
         if item["year"] and str(item["year"]) not in item["title"]:
@@ -142,53 +322,53 @@ class ArrService(TelegramHandler):
         caption = caption[0:1024]
         return caption
 
-    def get_queue_item(self, id: int):
-        return self.request(
+    async def get_queue_item(self, id: int):
+        return await self.request(
             f"queue/{id}",
             params=params,
             fallback=[],
         )
 
-    def get_queue(self, page: int = None, page_size: int = None):
+    async def get_queue(self, page: int = None, page_size: int = None):
         params = {}
         if page != None:
             params["page"] = page
         if page_size != None:
             params["page_size"] = page_size
-        return self.request(
+        return await self.request(
             "queue",
             params=params,
             fallback=[],
         )
 
-    def get_queue_details(self, movie_id: int = None, include_movie: bool = None):
+    async def get_queue_details(self, movie_id: int = None, include_movie: bool = None):
         params = {}
         if movie_id:
             params["movieId"] = movie_id
         if include_movie != None:
             params["includeMovie"] = include_movie
-        return self.request(
+        return await self.request(
             "queue",
             params=params,
             fallback=[],
         )
 
-    def get_queue_detail(self, id: int):
-        return self.request(
+    async def get_queue_detail(self, id: int):
+        return await self.request(
             f"queue/details/{id}",
             params={},
             fallback=[],
         )
 
-    def list_(self):
+    async def list_(self):
         if not self.arr_variant:
             return NotImplementedError(
                 "Unsupported Arr variant. You have to implement your own search"
             )
 
-        return self.request(f"{self.arr_variant.value}", fallback=[])
+        return await self.request(f"{self.arr_variant.value}", fallback=[])
 
-    def lookup(self, term: str = None):
+    async def lookup(self, term: str = None):
         if not self.arr_variant:
             return NotImplementedError(
                 "Unsupported Arr variant. You have to implement your own search"
@@ -196,13 +376,36 @@ class ArrService(TelegramHandler):
         if not term:
             return []
 
-        return self.request(
+        cached = await self.lookup_cache.get(self._lookup_namespace, term)
+        if cached is not None:
+            return cached
+
+        results = await self.request(
             f"{self.arr_variant.value}/lookup",
             params={"term": term},
-            fallback=[],
+            fallback=None,
         )
+        if results is None:
+            # Do not cache failed requests
+            return []
+
+        await self.lookup_cache.put(self._lookup_namespace, term, results)
+        return results
+
+    async def load_results(self, source):
+        # Refetch results a ResultSet has been created from
+        kind, *args = source
+        if kind == "lookup":
+            return await self.lookup(*args)
+        if kind == "list":
+            return await self.list_()
+        assert False, f"Unknown result source {kind}"
 
-    def add(
+    @property
+    def _lookup_namespace(self):
+        return f"{self.arr_variant.value}@{self.api_host}"
+
+    async def add(
         self,
         *,
         item=None,
@@ -224,7 +427,7 @@ class ArrService(TelegramHandler):
             action = Action.POST
             endpoint = self.arr_variant.value
 
-        return self.request(
+        result = await self.request(
             endpoint,
             action=action,
             params={
@@ -238,39 +441,50 @@ class ArrService(TelegramHandler):
                 **options,
             },
         )
+        if result:
+            await self.lookup_cache.invalidate(self._lookup_namespace, item)
+        return result
 
-    def remove(self, *, id=None):
+    async def remove(self, *, id=None, item=None):
         assert id, "Missing required arg! You need to provide a id!"
-        return self.request(
+        result = await self.request(
             f"{self.arr_variant.value}/{id}",
             action=Action.DELETE,
         )
+        if item:
+            await self.lookup_cache.invalidate(self._lookup_namespace, item)
+        return result
 
-    def get_root_folders(self) -> List[str]:
-        return self.request("rootfolder", fallback=[])
+    async def get_root_folders(self) -> List[str]:
+        return await self.request("rootfolder")
 
-    def get_root_folder(self, id: str) -> List[str]:
-        return self.request(f"rootfolder/{id}", fallback={})
+    async def get_root_folder(self, id: str) -> List[str]:
+        return await self.request(f"rootfolder/{id}", fallback={})
 
-    def get_tags(self):
-        return self.request("tag", fallback=[])
+    async def get_tags(self):
+        return await self.request("tag")
 
-    def get_tag(self, id: str):
-        return self.request(f"tag/{id}", fallback={})
+    async def get_tag(self, id: str):
+        return await self.request(f"tag/{id}", fallback={})
 
-    def add_tag(self, label):
-        return self.request(
+    async def add_tag(self, label):
+        tag = await self.request(
             "tag", action=Action.POST, params={"label": label}, fallback={}
         )
+        self.reference.invalidate()
+        return tag
+
+    async def get_quality_profiles(self):
+        return await self.request("qualityprofile")
+
+    async def get_quality_profile(self, id):
+        return await self.request(f"qualityprofile/{id}", fallback={})
 
-    def get_quality_profiles(self):
-        return self.request("qualityprofile", fallback=[])
+    async def get_language_profiles(self):
+        return await self.request("languageprofile")
 
-    def get_quality_profile(self, id):
-        return self.request(f"qualityprofile/{id}", fallback={})
+    async def get_language_profile(self, id):
+        return await self.request(f"languageprofile/{id}", fallback={})
 
-    def get_language_profiles(self):
-        return self.request("languageprofile", fallback=[])
 
-    def get_language_profile(self, id):
-        return self.request(f"languageprofile/{id}", fallback={})
+register_reference(ArrService, "ArrService", lambda s: s.commands[0], get_service)
@@ -2,8 +2,9 @@ from loguru import logger
 from typing import Optional, List, Any, Literal
 from dataclasses import dataclass, replace
 
-from . import ArrService, ArrVariant, Action, ServiceContent, find_first
+from . import ArrService, ArrVariant, Action, ServiceContent, ServiceUnavailable, find_first
 from .ext import ExtArrService, QueueState, Addon, ParentState
+from .reference import ReferenceData
 from ..tg_handler import command, callback, handler
 from ..tg_handler.message import (
     Response,
@@ -16,8 +17,10 @@ from ..tg_handler.session_state import (
     default_session_state_key_fn,
 )
 from ..tg_handler.keyboard import Button, keyboard
+from ..session_codec import session_type
 
 
+@session_type("bazarr.State")
 @dataclass(frozen=True)
 class State():
     items: List[Any]
@@ -41,17 +44,20 @@ class Bazarr(ExtArrService, ArrService, Addon):
         addons: List[ArrService] = []
     ):
         self.commands = commands
+        self.api_host = api_host
         self.api_key = api_key
-        
-        self.api_version = self.detect_api(api_host)
+
         self.service_content = ServiceContent.SUBTITLES
         self.arr_variant = ArrVariant.BAZARR
+        self.reference = ReferenceData({})
 
         self.name = name
         self.supported_services = [ArrVariant.RADARR, ArrVariant.SONARR]
         self.addons = addons
-        
-    
+
+    async def load(self):
+        self.api_version = await self.detect_api(self.api_host)
+
     @keyboard
     def keyboard(self, state: State, allow_edit=False):
 
@@ -100,37 +106,31 @@ class Bazarr(ExtArrService, ArrService, Addon):
         return [row_navigation, *rows_menu, *rows_action]
 
 
-    def detect_api(self, api_host):
-        status = None
+    async def detect_api(self, api_host):
         # Detect version and api_url
-        try:
-            self.api_url = f"{api_host.rstrip('/')}/api"
-            status = self.request("system/status")
-        finally:
-            if status is None:
-                logger.error(
-                    "Could not reach compatible api. Is the service down? Is your API key correct?"
-                )
-                exit(1)
-            assert (
-                status
-            ), "Could not reach compatible api. Is the service down? Is your API key correct?"
-            api_version = status.get("data", {}).get("bazarr_version", "")
-            assert api_version, "Could not find compatible api."
-            return api_version
+        self.api_url = f"{api_host.rstrip('/')}/api"
+        status = await self.request("system/status")
+
+        if not status:
+            raise ServiceUnavailable(
+                f"Could not reach a compatible api at {self.api_url}. Is the service down? Is your API key correct?"
+            )
+        api_version = status.get("data", {}).get("bazarr_version", "")
+        assert api_version, "Could not find compatible api."
+        return api_version
     
     
-    def search(self, arr_variant, id):
+    async def search(self, arr_variant, id):
         if arr_variant == ArrVariant.RADARR:
-            status = self.request('providers/movies', params={'radarrid': id}, fallback=[])
+            status = await self.request('providers/movies', params={'radarrid': id}, fallback=[])
             return status.get('data') if len(status) > 0 else status
         if arr_variant == ArrVariant.SONARR:
-            status = self.request('providers/episodes', params={'episodeid': id}, fallback=[])
+            status = await self.request('providers/episodes', params={'episodeid': id}, fallback=[])
             return status.get('data') if len(status) > 0 else status
         else:
             assert False, f"Bazarr integration not Implemented"
 
-    def download(
+    async def download(
         self,
         service,
         id,
@@ -172,7 +172,7 @@ class Bazarr(ExtArrService, ArrService, Addon):
             )
             return False
         
-        return self.request(
+        return await self.request(
                 method,
                 action=Action.POST,
                 params=params,
@@ -180,7 +180,7 @@ class Bazarr(ExtArrService, ArrService, Addon):
             )
 
     
-    def create_message(self, state: State, full_redraw=False, allow_edit=False):
+    async def create_message(self, state: State, full_redraw=False, allow_edit=False):
         if not state.items:
             keyboard_markup = self.keyboard(state, allow_edit=allow_edit)
 
@@ -197,7 +197,9 @@ class Bazarr(ExtArrService, ArrService, Addon):
         media_item = parent.state.items[parent.state.index]
 
         if ArrVariant(parent.service.arr_variant) == ArrVariant.SONARR:
-            reply_message = parent.service.episode_caption(media_item)
+            reply_message = await parent.service.episode_caption(
+                media_item, parent.state.selected_episode_id
+            )
         else:
             reply_message = parent.service.get_media_caption(media_item)
 
@@ -227,7 +229,7 @@ class Bazarr(ExtArrService, ArrService, Addon):
 
         arr_variant = parent.service.arr_variant
         
-        items = self.search(arr_variant=arr_variant, id=media_id)  
+        items = await self.search(arr_variant=arr_variant, id=media_id)  
 
         state = State(
             items=items,
@@ -238,9 +240,9 @@ class Bazarr(ExtArrService, ArrService, Addon):
             parent=parent
         )
 
-        auth_level = get_auth_level_from_message(self.db, update)
+        auth_level = await get_auth_level_from_message(self.db, update)
         allow_edit = auth_level >= AuthLevels.USER.value
-        return self.create_message(state, full_redraw=False, allow_edit=allow_edit)
+        return await self.create_message(state, full_redraw=False, allow_edit=allow_edit)
 
     @repaint
     @callback(cmds=["download"])
@@ -256,7 +258,7 @@ class Bazarr(ExtArrService, ArrService, Addon):
                     menu="success",
                 )
 
-        result = self.download(
+        result = await self.download(
             id = state.media_id,
             service=state.arr_variant,
             item=state.items[state.index]
@@ -266,7 +268,7 @@ class Bazarr(ExtArrService, ArrService, Addon):
         or result.status_code > 299:
             return Response(caption=f"Something went wrong... {result.content}")
         
-        return self.create_message(state, full_redraw=False)
+        return await self.create_message(state, full_redraw=False)
     
     @Addon.load
     def radarr_integration(self, item, buttons, **kwargs):
@@ -287,7 +289,7 @@ class Bazarr(ExtArrService, ArrService, Addon):
             )
         
     @Addon.load
-    def sonarr_integration(self, item, buttons, **kwargs):
+    async def sonarr_integration(self, item, buttons, **kwargs):
         parent = kwargs.get('parent')
         in_library = "id" in item and item["id"]
 
@@ -304,8 +306,8 @@ class Bazarr(ExtArrService, ArrService, Addon):
 
         elif parent.state.menu == "episode":
 
-            episodeId = item['selectedEpisodeId']
-            episode = parent.service.get_episode(episodeId)
+            episodeId = parent.state.selected_episode_id
+            episode = await parent.service.get_episode(episodeId)
             downloaded = True if episode['hasFile'] else False
 
             if downloaded:
@@ -317,7 +319,7 @@ class Bazarr(ExtArrService, ArrService, Addon):
                 )
 
     @Addon.init
-    def addon_buttons(self, **kwargs):
+    async def addon_buttons(self, **kwargs):
         parent = self.parent
         item = parent.state.items[parent.state.index]
 
@@ -325,7 +327,7 @@ class Bazarr(ExtArrService, ArrService, Addon):
         if ArrVariant(parent.service.arr_variant) == ArrVariant.RADARR:
             self.radarr_integration(item, buttons)
         elif ArrVariant(parent.service.arr_variant) == ArrVariant.SONARR:
-            self.sonarr_integration(item, buttons)
+            await self.sonarr_integration(item, buttons)
         else:
             raise NotImplementedError(f'{parent.service.arr_variant} integration not implemented')
         return buttons
@@ -15,8 +15,10 @@ from ..tg_handler.message import Response, repaint, clear
 from ..tg_handler.auth import authorized
 from ..tg_handler.session_state import sessionState, default_session_state_key_fn
 from ..tg_handler.keyboard import Button, keyboard
+from ..session_codec import session_type
 
 
+@session_type("queue.QueueState")
 @dataclass(frozen=True)
 class QueueState:
     items: Dict[str, Any]
@@ -81,7 +83,7 @@ class ExtArrService(ArrService):
         )
 
     async def cmd_queue(self, update, context, args):
-        items = self.get_queue(page=0, page_size=PAGE_SIZE)
+        items = await self.get_queue(page=0, page_size=PAGE_SIZE)
 
         state = QueueState(
             items=items,
@@ -92,7 +94,7 @@ class ExtArrService(ArrService):
         return self.create_queue_message(state)
 
     async def clbk_queue(self, update, context, args):
-        items = self.get_queue(page=int(args[1]), page_size=PAGE_SIZE)
+        items = await self.get_queue(page=int(args[1]), page_size=PAGE_SIZE)
 
         state = QueueState(
             items=items,
@@ -117,6 +119,7 @@ Following commands are available:
         return await update.message.reply_text(response_message, parse_mode="Markdown")
 
     
+@session_type("addon.ParentState")
 @dataclass(frozen=True)
 class ParentState:
     service: ArrService = None
@@ -161,5 +164,5 @@ class Addon:
     
 
     @init
-    def addon_buttons(self, state, **kwargs): 
+    async def addon_buttons(self, state, **kwargs):
         raise NotImplementedError
@@ -2,7 +2,8 @@ from loguru import logger
 from typing import Optional, List, Any, Literal
 from dataclasses import dataclass, replace
 
-from . import ArrService, ArrVariant, Action, ServiceContent, find_first
+from . import ArrService, ArrVariant, Action, ServiceContent
+from .reference import ReferenceData
 from .ext import ExtArrService, QueueState
 from ..tg_handler import command, callback, handler
 from ..tg_handler.message import (
@@ -16,8 +17,11 @@ from ..tg_handler.session_state import (
     default_session_state_key_fn,
 )
 from ..tg_handler.keyboard import Button, keyboard
+from ..result_store import ResultSet
+from ..session_codec import session_type
 
 
+@session_type("radarr.State")
 @dataclass(frozen=True)
 class State:
     items: List[Any]
@@ -41,20 +45,29 @@ class Radarr(ExtArrService, ArrService):
         addons: List[ArrService] = []
     ): 
         self.commands = commands
+        self.api_host = api_host
         self.api_key = api_key
 
-        self.api_version = self.detect_api(api_host)
         self.service_content = ServiceContent.MOVIE
         self.arr_variant = ArrVariant.RADARR
-        self.root_folders = self.get_root_folders()
-        self.quality_profiles = self.get_quality_profiles()
-        
+        self.reference = ReferenceData(
+            {
+                "rootfolder": self.get_root_folders,
+                "qualityprofile": self.get_quality_profiles,
+                "tag": self.get_tags,
+            }
+        )
+
         self.name = name
         self.addons = addons
 
+    async def load(self):
+        self.api_version = await self.detect_api(self.api_host)
+        await self.reference.refresh()
+
 
     @keyboard
-    def keyboard(self, state: State, allow_edit=False):
+    async def keyboard(self, state: State, allow_edit=False):
         item = state.items[state.index]
         in_library = "id" in item and item["id"]
 
@@ -87,7 +100,7 @@ class Radarr(ExtArrService, ArrService):
 
         elif state.menu == "tags":
             row_navigation = [Button("=== Selecting Tags ===")]
-            tags = self.get_tags() or []
+            tags = self.reference.list("tag")
             rows_menu = [
                 (
                     [
@@ -168,7 +181,7 @@ class Radarr(ExtArrService, ArrService):
             ]
         
         for addon in self.addons:
-            addon_buttons = addon.addon_buttons(parent=self, state=state, menu="addmenu")
+            addon_buttons = await addon.addon_buttons(parent=self, state=state, menu="addmenu")
             rows_menu.append(addon_buttons)
 
         rows_action = []
@@ -213,7 +226,7 @@ class Radarr(ExtArrService, ArrService):
 
         return [row_navigation, *rows_menu, *rows_action]
 
-    def create_message(self, state: State, full_redraw=False, allow_edit=False):
+    async def create_message(self, state: State, full_redraw=False, allow_edit=False):
         if not state.items:
             return Response(
                 caption="No movies found",
@@ -222,13 +235,15 @@ class Radarr(ExtArrService, ArrService):
 
         item = state.items[state.index]
 
-        keyboard_markup = self.keyboard(state, allow_edit=allow_edit)
+        # Start the background fetches before the rest of the message is built
+        if full_redraw:
+            self.prefetch(state)
+
+        keyboard_markup = await self.keyboard(state, allow_edit=allow_edit)
 
         reply_message = self.get_media_caption(item)
         
-        cover_url = item.get("remotePoster")
-        if not cover_url and len(item.get("images")):
-            cover_url = item.get("images")[0]["remoteUrl"]
+        cover_url = self.get_poster_url(item)
 
         return Response(
             photo=cover_url if full_redraw else None,
@@ -242,18 +257,12 @@ class Radarr(ExtArrService, ArrService):
             items=items,
             index=0,
             root_folder=(
-                find_first(
-                    self.root_folders,
-                    lambda x: items[0].get("folderName").startswith(x.get("path")),
-                )
+                self.reference.match_root_folder(items[0].get("folderName"))
                 if items
                 else None
             ),
             quality_profile=(
-                find_first(
-                    self.quality_profiles,
-                    lambda x: items[0].get("qualityProfileId") == x.get("id"),
-                )
+                self.reference.get("qualityprofile", items[0].get("qualityProfileId"))
                 if items
                 else None
             ),
@@ -274,16 +283,16 @@ class Radarr(ExtArrService, ArrService):
         if len(args) > 1 and args[0] == "search":
             args = args[1:]
         title = " ".join(args)
-        items = self.lookup(title)
+        items = await ResultSet.create(await self.lookup(title), ("lookup", title))
         state = self._get_initial_state(items)
 
-        self.session_db.add_session_entry(
+        await self.session_db.add_session_entry(
             default_session_state_key_fn(self, update), state
         )
 
-        auth_level = get_auth_level_from_message(self.db, update)
+        auth_level = await get_auth_level_from_message(self.db, update)
         allow_edit = auth_level >= AuthLevels.MOD.value
-        return self.create_message(state, full_redraw=True, allow_edit=allow_edit)
+        return await self.create_message(state, full_redraw=True, allow_edit=allow_edit)
 
     @command(cmds=[("help", "", "Shows only the radarr help page")])
     async def cmd_help(self, update, context, args):
@@ -297,18 +306,19 @@ class Radarr(ExtArrService, ArrService):
 
     @repaint
     @command(cmds=[("list", "", "List all series in the library")])
+    @sessionState(init=True)
     @authorized(min_auth_level=AuthLevels.USER.value)
     async def cmd_list(self, update, context, args):
-        items = self.list_()
+        items = await ResultSet.create(await self.list_(), ("list",))
 
         state = self._get_initial_state(items)
-        self.session_db.add_session_entry(
+        await self.session_db.add_session_entry(
             default_session_state_key_fn(self, update), state
         )
 
-        auth_level = get_auth_level_from_message(self.db, update)
+        auth_level = await get_auth_level_from_message(self.db, update)
         allow_edit = auth_level >= AuthLevels.MOD.value
-        return self.create_message(state, full_redraw=True, allow_edit=allow_edit)
+        return await self.create_message(state, full_redraw=True, allow_edit=allow_edit)
 
     @repaint
     @callback(cmds=["queue"])
@@ -333,7 +343,7 @@ class Radarr(ExtArrService, ArrService):
     @sessionState()
     @authorized(min_auth_level=AuthLevels.USER)
     async def clbk_update(self, update, context, args, state):
-        auth_level = get_auth_level_from_message(self.db, update)
+        auth_level = await get_auth_level_from_message(self.db, update)
         allow_edit = auth_level >= AuthLevels.MOD.value
         # Prevent any changes from being made if in library and permission level below MOD
         if args[0] in ["addtag", "remtag", "selectpath", "selectquality"]:
@@ -350,13 +360,11 @@ class Radarr(ExtArrService, ArrService):
                 state = replace(
                     state,
                     index=idx,
-                    root_folder=find_first(
-                        self.root_folders,
-                        lambda x: item.get("folderName").startswith(x.get("path")),
+                    root_folder=self.reference.match_root_folder(
+                        item.get("folderName")
                     ),
-                    quality_profile=find_first(
-                        self.quality_profiles,
-                        lambda x: item.get("qualityProfileId") == x.get("id"),
+                    quality_profile=self.reference.get(
+                        "qualityprofile", item.get("qualityProfileId")
                     ),
                     tags=item.get("tags", []),
                     menu=None,
@@ -373,17 +381,17 @@ class Radarr(ExtArrService, ArrService):
         elif args[0] == "path":
             state = replace(state, menu="path")
         elif args[0] == "selectpath":
-            path = self.get_root_folder(args[1])
+            path = self.reference.get("rootfolder", args[1])
             state = replace(state, root_folder=path, menu="add")
         elif args[0] == "quality":
             state = replace(state, menu="quality")
         elif args[0] == "selectquality":
-            quality_profile = self.get_quality_profile(args[1])
+            quality_profile = self.reference.get("qualityprofile", args[1])
             state = replace(state, quality_profile=quality_profile, menu="add")
         elif args[0] == "addmenu":
             state = replace(state, menu="add")
 
-        return self.create_message(
+        return await self.create_message(
             state, full_redraw=full_redraw, allow_edit=allow_edit
         )
 
@@ -392,7 +400,7 @@ class Radarr(ExtArrService, ArrService):
     @sessionState(clear=True)
     @authorized(min_auth_level=AuthLevels.USER)
     async def clbk_add(self, update, context, args, state):
-        result = self.add(
+        result = await self.add(
             item=state.items[state.index],
             quality_profile_id=state.quality_profile.get("id"),
             root_folder_path=state.root_folder.get("path"),
@@ -417,7 +425,8 @@ class Radarr(ExtArrService, ArrService):
     @sessionState(clear=True)
     @authorized(min_auth_level=AuthLevels.MOD)
     async def clbk_remove(self, update, context, args, state):
-        self.remove(id=state.items[state.index].get("id"))
+        item = state.items[state.index]
+        await self.remove(id=item.get("id"), item=item)
         return Response(caption="Movie removed!")
 
         
@@ -0,0 +1,108 @@
+import time
+import asyncio
+import contextvars
+
+from loguru import logger
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from ..config.cache import REFERENCE_TTL
+
+# Returns None if the items could not be fetched
+Fetcher = Callable[[], Awaitable[Optional[List[Any]]]]
+
+
+class ReferenceData:
+    """
+    Registry of rarely changing arr objects (root folders, profiles, tags).
+
+    Serves everything from memory, indexed by id. Once the data is older
+    than the ttl it is refreshed in the background, while the stale data
+    keeps being served. Kinds that fail to refresh keep their previous data,
+    and are retried on the next use.
+    """
+
+    fetchers: Dict[str, Fetcher]
+    ttl: float
+    loaded_at: Optional[float]
+
+    def __init__(self, fetchers: Dict[str, Fetcher], ttl: float = REFERENCE_TTL):
+        self.fetchers = fetchers
+        self.ttl = ttl
+        self.loaded_at = None
+        self._items: Dict[str, List[Any]] = {kind: [] for kind in fetchers}
+        self._by_id: Dict[str, Dict[str, Any]] = {kind: {} for kind in fetchers}
+        self._root_folder_prefixes: List[Any] = []
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def refresh(self):
+        kinds = list(self.fetchers.keys())
+        results = await asyncio.gather(*(self.fetchers[kind]() for kind in kinds))
+        failed = []
+        for kind, items in zip(kinds, results):
+            if items is None:
+                failed.append(kind)
+            else:
+                self._set(kind, items)
+        if failed:
+            logger.warning(f"Could not refresh reference data: {failed}")
+            return
+        self.loaded_at = time.monotonic()
+        logger.debug(f"Refreshed reference data: {kinds}")
+
+    def _set(self, kind: str, items: List[Any]):
+        self._items[kind] = items
+        self._by_id[kind] = {str(e.get("id")): e for e in items}
+        if kind == "rootfolder":
+            # Longest paths first, so the first prefix match is the most specific one
+            self._root_folder_prefixes = sorted(
+                items, key=lambda e: len(e.get("path") or ""), reverse=True
+            )
+
+    def dump(self) -> Dict[str, List[Any]]:
+        return dict(self._items)
+
+    def restore(self, items: Dict[str, List[Any]]):
+        # Serve the restored data right away, but refresh it on first use
+        for kind in self.fetchers:
+            self._set(kind, items.get(kind) or [])
+        self.loaded_at = None
+
+    def invalidate(self):
+        self.loaded_at = None
+        self._maybe_refresh()
+
+    def _maybe_refresh(self):
+        fresh = self.loaded_at and time.monotonic() - self.loaded_at < self.ttl
+        if fresh or (self._refresh_task and not self._refresh_task.done()):
+            return
+        try:
+            # Outside of the update's context, so its deadline does not apply
+            self._refresh_task = asyncio.get_running_loop().create_task(
+                self._background_refresh(), context=contextvars.Context()
+            )
+        except RuntimeError:
+            # No running loop (e.g. during shutdown), keep serving what we have
+            pass
+
+    async def _background_refresh(self):
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.warning(f"Could not refresh reference data: {e}")
+
+    def list(self, kind: str) -> List[Any]:
+        self._maybe_refresh()
+        return self._items.get(kind, [])
+
+    def get(self, kind: str, id) -> Any:
+        self._maybe_refresh()
+        items = self._items.get(kind, [])
+        return self._by_id.get(kind, {}).get(str(id)) or (items[0] if items else {})
+
+    def match_root_folder(self, path: Optional[str]) -> Any:
+        self._maybe_refresh()
+        for root_folder in self._root_folder_prefixes:
+            if (path or "").startswith(root_folder.get("path") or ""):
+                return root_folder
+        items = self._items.get("rootfolder", [])
+        return items[0] if items else {}
@@ -1,8 +1,10 @@
 from loguru import logger
 from typing import Optional, List, Any, Literal
 from dataclasses import dataclass, replace
+from functools import partial
 
-from . import ArrService, ArrVariant, Action, ServiceContent, find_first, is_int
+from . import ArrService, ArrVariant, Action, ServiceContent, is_int
+from .reference import ReferenceData
 from .ext import ExtArrService
 from ..tg_handler import command, callback, handler
 from ..tg_handler.message import (
@@ -16,14 +18,18 @@ from ..tg_handler.session_state import (
     default_session_state_key_fn,
 )
 from ..tg_handler.keyboard import Button, keyboard
+from ..result_store import ResultSet
+from ..session_codec import session_type, migration
 
 
+@session_type("sonarr.SeasonState")
 @dataclass(frozen=True)
 class SeasonState:
     available: List[int]
     selected: List[int]
 
 
+@session_type("sonarr.State", version=2)
 @dataclass(frozen=True)
 class State:
     items: List[Any]
@@ -40,6 +46,20 @@ class State:
         | Literal["language"]
         | Literal["add"]
     ]
+    # Season and episode browsed in the season/episode menus
+    selected_season: Optional[int] = None
+    selected_episode: Optional[int] = None
+    selected_episode_id: Optional[int] = None
+
+
+@migration("sonarr.State", 1)
+def _add_selected_episode(values):
+    return {
+        **values,
+        "selected_season": None,
+        "selected_episode": None,
+        "selected_episode_id": None,
+    }
 
 
 @handler
@@ -53,18 +73,27 @@ class Sonarr(ExtArrService, ArrService):
         addons: List[ArrService] = []
     ):
         self.commands = commands
+        self.api_host = api_host
         self.api_key = api_key
 
-        self.api_version = self.detect_api(api_host)
         self.service_content = ServiceContent.SERIES
         self.arr_variant = ArrVariant.SONARR
-        self.root_folders = self.get_root_folders()
-        self.quality_profiles = self.get_quality_profiles()
-        self.language_profiles = self.get_language_profiles()
+        self.reference = ReferenceData(
+            {
+                "rootfolder": self.get_root_folders,
+                "qualityprofile": self.get_quality_profiles,
+                "languageprofile": self.get_language_profiles,
+                "tag": self.get_tags,
+            }
+        )
 
         self.name = name
         self.addons = addons
 
+    async def load(self):
+        self.api_version = await self.detect_api(self.api_host)
+        await self.reference.refresh()
+
     def _get_season_state(self, item):
         available_seasons = [e.get("seasonNumber") for e in item.get("seasons")]
         monitored_seasons = []
@@ -75,7 +104,7 @@ class Sonarr(ExtArrService, ArrService):
         )
 
     @keyboard
-    def keyboard(self, state: State, allow_edit=None):
+    async def keyboard(self, state: State, allow_edit=None):
         item = state.items[state.index]
         in_library = "id" in item and item["id"]
 
@@ -133,7 +162,7 @@ class Sonarr(ExtArrService, ArrService):
             ]
         elif state.menu == "tags":
             row_navigation = [Button("=== Selecting Tags ===")]
-            tags = self.get_tags() or []
+            tags = self.reference.list("tag")
             rows_menu = [
                 (
                     [
@@ -191,11 +220,11 @@ class Sonarr(ExtArrService, ArrService):
         
         elif state.menu == "season_list":
             row_navigation = []
-            rows_menu = self.get_btn_seasons(item["id"])
+            rows_menu = await self.get_btn_seasons(item["id"])
 
         elif state.menu == "episode_list":
             row_navigation = []
-            rows_menu = self.get_btn_episodes(item["id"], item["selectedSeasonNumber"])
+            rows_menu = await self.get_btn_episodes(item["id"], state.selected_season)
 
         elif state.menu == "episode":
             row_navigation = []
@@ -245,7 +274,7 @@ class Sonarr(ExtArrService, ArrService):
             ]
         
         for addon in self.addons:
-            addon_buttons = addon.addon_buttons(parent=self, state=state)
+            addon_buttons = await addon.addon_buttons(parent=self, state=state)
             rows_menu.append(addon_buttons)
 
         rows_action = []
@@ -317,7 +346,7 @@ class Sonarr(ExtArrService, ArrService):
 
         return [row_navigation, *rows_menu, *rows_action]
 
-    def create_message(self, state: State, full_redraw=False, allow_edit=False):
+    async def create_message(self, state: State, full_redraw=False, allow_edit=False):
         if not state.items:
             return Response(
                 caption="No series found",
@@ -326,13 +355,15 @@ class Sonarr(ExtArrService, ArrService):
 
         item = state.items[state.index]
 
-        keyboard_markup = self.keyboard(state, allow_edit=allow_edit)
+        # Before the keyboard, which then shares the requests already made
+        if full_redraw:
+            self.prefetch(state)
+
+        keyboard_markup = await self.keyboard(state, allow_edit=allow_edit)
 
         reply_message = self.get_media_caption(item)
 
-        cover_url = item.get("remotePoster")
-        if not cover_url and len(item.get("images")):
-            cover_url = item.get("images")[0]["remoteUrl"]
+        cover_url = self.get_poster_url(item)
 
         return Response(
             photo=cover_url if full_redraw else None,
@@ -346,25 +377,18 @@ class Sonarr(ExtArrService, ArrService):
             items=items,
             index=0,
             root_folder=(
-                find_first(
-                    self.root_folders,
-                    lambda x: items[0].get("folderName").startswith(x.get("path")),
-                )
+                self.reference.match_root_folder(items[0].get("folderName"))
                 if items
                 else None
             ),
             quality_profile=(
-                find_first(
-                    self.quality_profiles,
-                    lambda x: items[0].get("qualityProfileId") == x.get("id"),
-                )
+                self.reference.get("qualityprofile", items[0].get("qualityProfileId"))
                 if items
                 else None
             ),
             language_profile=(
-                find_first(
-                    self.language_profiles,
-                    lambda x: items[0].get("languageProfileId") == x.get("id"),
+                self.reference.get(
+                    "languageprofile", items[0].get("languageProfileId")
                 )
                 if items
                 else None
@@ -388,17 +412,17 @@ class Sonarr(ExtArrService, ArrService):
             args = args[1:]
         title = " ".join(args)
 
-        items = self.lookup(title)
+        items = await ResultSet.create(await self.lookup(title), ("lookup", title))
 
         state = self._get_initial_state(items)
 
-        self.session_db.add_session_entry(
+        await self.session_db.add_session_entry(
             default_session_state_key_fn(self, update), state
         )
 
-        auth_level = get_auth_level_from_message(self.db, update)
+        auth_level = await get_auth_level_from_message(self.db, update)
         allow_edit = auth_level >= AuthLevels.MOD.value
-        return self.create_message(state, full_redraw=True, allow_edit=allow_edit)
+        return await self.create_message(state, full_redraw=True, allow_edit=allow_edit)
 
     @command(cmds=[("help", "", "Shows only the sonarr help page")])
     async def cmd_help(self, update, context, args):
@@ -418,18 +442,19 @@ class Sonarr(ExtArrService, ArrService):
 
     @repaint
     @command(cmds=[("list", "", "List all series in the library")])
+    @sessionState(init=True)
     @authorized(min_auth_level=AuthLevels.USER.value)
     async def cmd_list(self, update, context, args):
-        items = self.list_()
+        items = await ResultSet.create(await self.list_(), ("list",))
 
         state = self._get_initial_state(items)
-        self.session_db.add_session_entry(
+        await self.session_db.add_session_entry(
             default_session_state_key_fn(self, update), state
         )
 
-        auth_level = get_auth_level_from_message(self.db, update)
+        auth_level = await get_auth_level_from_message(self.db, update)
         allow_edit = auth_level >= AuthLevels.MOD.value
-        return self.create_message(state, full_redraw=True, allow_edit=allow_edit)
+        return await self.create_message(state, full_redraw=True, allow_edit=allow_edit)
 
     @repaint
     @callback(
@@ -454,7 +479,7 @@ class Sonarr(ExtArrService, ArrService):
     @sessionState()
     @authorized(min_auth_level=AuthLevels.USER)
     async def clbk_update(self, update, context, args, state):
-        auth_level = get_auth_level_from_message(self.db, update)
+        auth_level = await get_auth_level_from_message(self.db, update)
         allow_edit = auth_level >= AuthLevels.MOD.value
         # Prevent any changes from being made if in library and permission level below MOD
         if args[0] in [
@@ -478,13 +503,11 @@ class Sonarr(ExtArrService, ArrService):
                 state = replace(
                     state,
                     index=idx,
-                    root_folder=find_first(
-                        self.root_folders,
-                        lambda x: item.get("folderName").startswith(x.get("path")),
+                    root_folder=self.reference.match_root_folder(
+                        item.get("folderName")
                     ),
-                    quality_profile=find_first(
-                        self.quality_profiles,
-                        lambda x: item.get("qualityProfileId") == x.get("id"),
+                    quality_profile=self.reference.get(
+                        "qualityprofile", item.get("qualityProfileId")
                     ),
                     tags=item.get("tags", []),
                     menu=None,
@@ -499,7 +522,7 @@ class Sonarr(ExtArrService, ArrService):
         elif args[0] == "seasons":
             state = replace(state, menu="seasons")
         elif args[0] == "searchseason":
-            self.request(
+            await self.request(
                 "command",
                 action=Action.POST,
                 params={
@@ -520,17 +543,17 @@ class Sonarr(ExtArrService, ArrService):
         elif args[0] == "path":
             state = replace(state, menu="path")
         elif args[0] == "selectpath":
-            path = self.get_root_folder(args[1])
+            path = self.reference.get("rootfolder", args[1])
             state = replace(state, root_folder=path, menu="add")
         elif args[0] == "quality":
             state = replace(state, menu="quality")
         elif args[0] == "selectquality":
-            quality_profile = self.get_quality_profile(args[1])
+            quality_profile = self.reference.get("qualityprofile", args[1])
             state = replace(state, quality_profile=quality_profile, menu="add")
         elif args[0] == "language":
             state = replace(state, menu="language")
         elif args[0] == "selectlanguage":
-            language_profile = self.get_language_profile(args[1])
+            language_profile = self.reference.get("languageprofile", args[1])
             state = replace(state, language_profile=language_profile, menu="add")
         elif args[0] == "addmenu":
             state = replace(state, menu="add")
@@ -539,7 +562,7 @@ class Sonarr(ExtArrService, ArrService):
         elif args[0] == "episode":
             state = replace(state, menu="episode")
 
-        return self.create_message(
+        return await self.create_message(
             state, full_redraw=full_redraw, allow_edit=allow_edit
         )
 
@@ -548,7 +571,7 @@ class Sonarr(ExtArrService, ArrService):
     @sessionState(clear=True)
     @authorized(min_auth_level=AuthLevels.USER)
     async def clbk_add(self, update, context, args, state):
-        result = self.add(
+        result = await self.add(
             item=state.items[state.index],
             quality_profile_id=state.quality_profile.get("id", 0),
             language_profile_id=state.language_profile.get("id", 0),
@@ -584,7 +607,8 @@ class Sonarr(ExtArrService, ArrService):
     @sessionState(clear=True)
     @authorized(min_auth_level=AuthLevels.USER)
     async def clbk_remove(self, update, context, args, state):
-        self.remove(id=state.items[state.index].get("id"))
+        item = state.items[state.index]
+        await self.remove(id=item.get("id"), item=item)
         return Response(caption="Series removed!")
     
     @repaint
@@ -606,26 +630,27 @@ class Sonarr(ExtArrService, ArrService):
             caption = self.get_media_caption(item)
 
         elif args[0] == "episode_list":
-            state = replace(state, menu="episode_list")
-            seasonNumber = args[1] if len(args) > 1 else item.get("selectedSeasonNumber")
-            item["selectedSeasonNumber"] = seasonNumber
+            state = replace(
+                state,
+                menu="episode_list",
+                selected_season=args[1] if len(args) > 1 else state.selected_season,
+            )
             caption = self.get_media_caption(item)
-            caption += f'\n\nSeason {seasonNumber}'
+            caption += f'\n\nSeason {state.selected_season}'
+            self.prefetch(state)
 
         elif args[0] == "episode":
-            state = replace(state, menu="episode")
-
-            seasonNumber =  args[1] if len(args) > 1 else item.get("selectedSeasonNumber")
-            episodeNumber = args[2] if len(args) > 2 else item.get("selectedEpisodeNumber")
-            episodeId =     args[3] if len(args) > 3 else item.get("selectedEpisodeId")
-
-            item["selectedSeasonNumber"] = seasonNumber
-            item["selectedEpisodeNumber"] = episodeNumber
-            item["selectedEpisodeId"] = episodeId
+            state = replace(
+                state,
+                menu="episode",
+                selected_season=args[1] if len(args) > 1 else state.selected_season,
+                selected_episode=args[2] if len(args) > 2 else state.selected_episode,
+                selected_episode_id=args[3] if len(args) > 3 else state.selected_episode_id,
+            )
 
-            caption = self.episode_caption(item)
+            caption = await self.episode_caption(item, state.selected_episode_id)
 
-        keyboard_markup = self.keyboard(state, allow_edit=False)
+        keyboard_markup = await self.keyboard(state, allow_edit=False)
         
         return Response(
             caption=caption,
@@ -633,9 +658,8 @@ class Sonarr(ExtArrService, ArrService):
             state=state,
         )
     
-    def episode_caption(self, item):
-        episodeId = item.get("selectedEpisodeId")
-        episode = self.get_episode(episodeId)
+    async def episode_caption(self, item, episodeId):
+        episode = await self.get_episode(episodeId)
 
         caption = self.get_media_caption(item, overview=False)
         caption += f'\nSeason {episode["seasonNumber"]}, Ep. {episode["episodeNumber"]} - {episode["title"]}'
@@ -643,7 +667,7 @@ class Sonarr(ExtArrService, ArrService):
 
         return caption
     
-    def get_btn_seasons(self, seriesId) -> List:
+    async def get_btn_seasons(self, seriesId) -> List:
         return [
             [
                 Button(
@@ -651,10 +675,10 @@ class Sonarr(ExtArrService, ArrService):
                     self.get_clbk("episode_list", p.get("seasonNumber")),
                 )
             ]
-            for p in self.get_seasons(seriesId)
+            for p in await self.get_seasons(seriesId)
         ]
     
-    def get_btn_episodes(self, seriesId, seasonNumber) -> List:
+    async def get_btn_episodes(self, seriesId, seasonNumber) -> List:
         return [
             [
                 Button(
@@ -662,21 +686,40 @@ class Sonarr(ExtArrService, ArrService):
                     self.get_clbk("episode", seasonNumber, p.get("episodeNumber"), p.get("id")),
                 )
             ]
-            for p in self.get_episodes(seriesId, seasonNumber)
+            for p in await self.get_episodes(seriesId, seasonNumber)
+        ]
+
+    def prefetch_jobs(self, state: State):
+        if state.menu == "episode_list":
+            # Episodes, shown once one of them is picked
+            item = state.items[state.index]
+            return [partial(self._prefetch_episodes, item["id"], state.selected_season)]
+        # Seasons of the shown and neighbouring series in the library
+        return [
+            partial(self.prefetch_request, f"series/{state.items[i]['id']}")
+            for i in (state.index, state.index - 1, state.index + 1)
+            if 0 <= i < len(state.items) and state.items[i].get("id")
         ]
 
-    def get_seasons(self, seriesId) -> List:
-        series = self.request(f'series/{seriesId}', fallback=[])
+    async def _prefetch_episodes(self, seriesId, seasonNumber):
+        params = {'seriesId': seriesId, 'seasonNumber': seasonNumber}
+        # The list has all fields of each episode, so it serves them as well
+        for episode in await self.prefetch_request('episode', params) or []:
+            if episode.get("id"):
+                self.seed_prefetched(f'episode/{episode["id"]}', episode)
+
+    async def get_seasons(self, seriesId) -> List:
+        series = await self.request(f'series/{seriesId}', fallback=[])
 
         if len(series) > 0:
             return series.get('seasons')
         else:
             return series
     
-    def get_episodes(self, seriesId, seasonNumber) -> List:
+    async def get_episodes(self, seriesId, seasonNumber) -> List:
         params = {'seriesId': seriesId, 'seasonNumber': seasonNumber}
-        episodes = self.request('episode', params=params, fallback=[])
+        episodes = await self.request('episode', params=params, fallback=[])
         return episodes
     
-    def get_episode(self, episodeId):
-        return self.request(f'episode/{episodeId}', fallback=[])
\ No newline at end of file
+    async def get_episode(self, episodeId):
+        return await self.request(f'episode/{episodeId}', fallback=[])
\ No newline at end of file
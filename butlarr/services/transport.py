@@ -0,0 +1,92 @@
+import httpx
+import asyncio
+
+from typing import Awaitable, Callable, Dict, Hashable, List
+from loguru import logger
+from urllib.parse import urlsplit
+
+from .. import metrics
+from ..config.http import (
+    POOL_MAX_CONNECTIONS,
+    POOL_MAX_KEEPALIVE_CONNECTIONS,
+    POOL_KEEPALIVE_EXPIRY,
+)
+
+# One keep-alive pool per api host (scheme + netloc), shared across services
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _host_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_client(url: str) -> httpx.AsyncClient:
+    key = _host_key(url)
+    client = _clients.get(key)
+    if client is None or client.is_closed:
+        logger.debug(f"Creating connection pool for {key}")
+        client = httpx.AsyncClient(
+            follow_redirects=True,
+            limits=httpx.Limits(
+                max_connections=POOL_MAX_CONNECTIONS,
+                max_keepalive_connections=POOL_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=POOL_KEEPALIVE_EXPIRY,
+            ),
+        )
+        _clients[key] = client
+    return client
+
+
+async def close_clients():
+    for key, client in list(_clients.items()):
+        logger.debug(f"Closing connection pool for {key}")
+        await client.aclose()
+    _clients.clear()
+
+
+class SingleFlight:
+    """
+    Deduplicates identical concurrent calls.
+
+    While a call for a key is in flight, further callers with the same key
+    await its result instead of issuing their own call. The call is
+    cancelled once all of its callers are, and they wait for it to stop.
+    """
+
+    def __init__(self):
+        # key -> [task, number of callers awaiting it]
+        self._pending: Dict[Hashable, List] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        entry = self._pending.get(key)
+        if entry:
+            metrics.incr("arr.requests.coalesced")
+            logger.debug(f"Coalescing request {key}")
+        else:
+            # Run as own task, so a cancelled caller does not cancel the others
+            task = asyncio.ensure_future(fn())
+            entry = self._pending[key] = [task, 0]
+            task.add_done_callback(lambda t: self._done(key, t))
+        task = entry[0]
+        entry[1] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if entry[1] == 1 and not task.done():
+                # Nobody else awaits the call, stop it. Later callers start anew.
+                if self._pending.get(key) is entry:
+                    del self._pending[key]
+                task.cancel()
+                await asyncio.wait([task])
+            raise
+        finally:
+            entry[1] -= 1
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        entry = self._pending.get(key)
+        if entry and entry[0] is task:
+            del self._pending[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved, the callers handle it
+            task.exception()
@@ -0,0 +1,138 @@
+import zlib
+import pickle
+import msgpack
+
+from dataclasses import fields, is_dataclass
+from typing import Any, Callable, Dict, Tuple
+
+# Header byte of encoded values, followed by the msgpack payload
+FORMAT_PLAIN = b"\x01"
+FORMAT_ZLIB = b"\x02"
+# Payloads larger than this (bytes) are compressed
+COMPRESS_THRESHOLD = 1024
+# Favour speed, session payloads are small and written often
+COMPRESS_LEVEL = 1
+
+EXT_DATACLASS = 1
+EXT_REFERENCE = 2
+
+# name -> (class, current version)
+_session_types: Dict[str, Tuple[type, int]] = {}
+_session_type_names: Dict[type, str] = {}
+# (name, from_version) -> function migrating the fields to from_version + 1
+_migrations: Dict[Tuple[str, int], Callable[[Dict[str, Any]], Dict[str, Any]]] = {}
+# name -> (class, encode, decode)
+_references: Dict[str, Tuple[type, Callable, Callable]] = {}
+
+
+class SessionDecodeError(Exception):
+    pass
+
+
+def session_type(name: str, version: int = 1):
+    """
+    Registers a dataclass to be encoded by name and schema version.
+
+    Bump the version whenever fields change, and register a `migration`
+    from the previous version.
+    """
+
+    def decorator(cls):
+        assert is_dataclass(cls), f"Session type {name} has to be a dataclass!"
+        assert name not in _session_types, f"Session type {name} registered twice!"
+        _session_types[name] = (cls, version)
+        _session_type_names[cls] = name
+        return cls
+
+    return decorator
+
+
+def migration(name: str, from_version: int):
+    def decorator(func):
+        _migrations[(name, from_version)] = func
+        return func
+
+    return decorator
+
+
+def register_reference(cls: type, name: str, encode: Callable, decode: Callable):
+    # Objects that are stored as a reference (e.g. services, enums) instead of their content
+    _references[name] = (cls, encode, decode)
+
+
+def _default(obj):
+    name = _session_type_names.get(type(obj))
+    if name:
+        _, version = _session_types[name]
+        values = {f.name: getattr(obj, f.name) for f in fields(obj)}
+        return msgpack.ExtType(EXT_DATACLASS, _pack([name, version, values]))
+
+    for name, (cls, encode, _) in _references.items():
+        if isinstance(obj, cls):
+            return msgpack.ExtType(EXT_REFERENCE, _pack([name, encode(obj)]))
+
+    raise TypeError(f"Cannot encode session value of type {type(obj).__name__}")
+
+
+def _ext_hook(code, data):
+    if code == EXT_DATACLASS:
+        name, version, values = _unpack(data)
+        if name not in _session_types:
+            raise SessionDecodeError(f"Unknown session type {name}")
+        cls, current_version = _session_types[name]
+        while version < current_version:
+            migrate = _migrations.get((name, version))
+            if not migrate:
+                raise SessionDecodeError(
+                    f"No migration of {name} from version {version}"
+                )
+            values = migrate(values)
+            version += 1
+        if version > current_version:
+            raise SessionDecodeError(f"{name} version {version} is newer than supported")
+        try:
+            return cls(**values)
+        except TypeError as e:
+            raise SessionDecodeError(f"Fields of {name} do not match: {e}")
+
+    if code == EXT_REFERENCE:
+        name, payload = _unpack(data)
+        if name not in _references:
+            raise SessionDecodeError(f"Unknown session reference {name}")
+        return _references[name][2](payload)
+
+    return msgpack.ExtType(code, data)
+
+
+def _pack(value) -> bytes:
+    return msgpack.packb(value, default=_default, use_bin_type=True)
+
+
+def _unpack(data: bytes):
+    return msgpack.unpackb(data, ext_hook=_ext_hook, raw=False, strict_map_key=False)
+
+
+def encode(value) -> bytes:
+    data = _pack(value)
+    if len(data) > COMPRESS_THRESHOLD:
+        return FORMAT_ZLIB + zlib.compress(data, COMPRESS_LEVEL)
+    return FORMAT_PLAIN + data
+
+
+def decode(data: bytes, allow_pickle: bool = False):
+    # Pickles may run arbitrary code, only allow them for data written locally
+    header, payload = data[:1], data[1:]
+    try:
+        if header == FORMAT_PLAIN:
+            return _unpack(payload)
+        if header == FORMAT_ZLIB:
+            return _unpack(zlib.decompress(payload))
+        if header == b"\x80" and allow_pickle:
+            # Written by an older version, before sessions were encoded
+            return pickle.loads(data)
+    except SessionDecodeError:
+        raise
+    except Exception as e:
+        # Corrupt or truncated data, or values of classes that no longer exist
+        raise SessionDecodeError(f"Could not decode session data: {e!r}") from e
+    raise SessionDecodeError(f"Unknown session format {header!r}")
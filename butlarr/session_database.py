@@ -1,53 +1,410 @@
 import os
+import time
 import pickle
-import re
+import sqlite3
+import asyncio
 
 from pathlib import Path
 from loguru import logger
 from threading import Lock
+from typing import Dict, Optional, Set, Tuple
 
-BASE_PATH = os.path.join(
-    Path(os.path.dirname(os.path.realpath(__file__))).parent, "data", "session"
+from .cache import LRUCache
+from .backend import RedisBackend, get_backend
+from .session_codec import encode, decode, SessionDecodeError
+from .config.session import (
+    SESSION_CACHE_ENTRIES,
+    SESSION_FLUSH_DELAY,
+    SESSION_TTL,
+    SESSION_SWEEP_BATCH,
 )
 
+DATA_PATH = os.path.join(
+    Path(os.path.dirname(os.path.realpath(__file__))).parent, "data"
+)
+DEFAULT_PATH = os.path.join(DATA_PATH, "session.sqlite")
+# Directory of the former file-per-key session store, migrated on startup
+BASE_PATH = os.path.join(DATA_PATH, "session")
 
-class SessionDatabase:
+# (session_id, key)
+EntryKey = Tuple[str, str]
+
+
+class SessionStore:
+    """
+    Storage of encoded session entries used by `SessionDatabase`.
+
+    Stores that are `shared` between bot instances are read on every access,
+    instead of being fronted by the in-memory cache.
+    """
+
+    shared = False
+    # Whether stored values may still be pickles of an older version. Only
+    # for local stores, as unpickling runs whatever the data says.
+    legacy_pickles = False
+
+    def load(self, entry_key: EntryKey) -> Optional[Tuple[bytes, float]]:
+        # Returns the encoded value and its last access
+        raise NotImplementedError
+
+    def write(
+        self,
+        dirty: Dict[EntryKey, bytes],
+        cleared: Set[str],
+        touched: Dict[EntryKey, float],
+    ):
+        raise NotImplementedError
+
+    def sweep(self, expires_before: float, limit: int) -> int:
+        raise NotImplementedError
+
+
+class SqliteSessionStore(SessionStore):
+    legacy_pickles = True
     lock = Lock()
-    base_path: Path
+    db_file: Path
 
-    def __init__(self, base_path=BASE_PATH):
-        self.base_path = Path(base_path)
+    def __init__(self, db_file=DEFAULT_PATH):
+        self.db_file = Path(db_file)
+        self._con = None
+
+    def _get_con(self):
+        # Opened on first use, not when the services are imported
+        if self._con is None:
+            self._con = self._connect()
+        return self._con
+
+    def _connect(self):
         # Make sure the path exists
-        self.base_path.mkdir(exist_ok=True, parents=True)
+        self.db_file.parent.mkdir(exist_ok=True, parents=True)
+        con = sqlite3.connect(self.db_file, check_same_thread=False)
+        con.execute("PRAGMA journal_mode = wal;")
+        con.execute("PRAGMA synchronous = normal;")
+        con.execute(
+            """CREATE TABLE IF NOT EXISTS sessions (
+                session_id text not null,
+                key text not null default '',
+                value blob not null,
+                updated_at real not null,
+                accessed_at real not null default 0,
+                primary key (session_id, key)
+            );"""
+        )
+        columns = [c[1] for c in con.execute("PRAGMA table_info(sessions);")]
+        if "accessed_at" not in columns:
+            con.execute(
+                "ALTER TABLE sessions ADD COLUMN accessed_at real not null default 0;"
+            )
+            con.execute("UPDATE sessions SET accessed_at=updated_at;")
+        con.execute(
+            "CREATE INDEX IF NOT EXISTS sessions_accessed_at ON sessions (accessed_at);"
+        )
+        con.commit()
+        return con
+
+    def load(self, entry_key):
+        with self.lock:
+            return self._get_con().execute(
+                "SELECT value, accessed_at FROM sessions WHERE session_id=? AND key=?;",
+                entry_key,
+            ).fetchone()
+
+    def write(self, dirty, cleared, touched):
+        now = time.time()
+        with self.lock:
+            con = self._get_con()
+            try:
+                con.executemany(
+                    "DELETE FROM sessions WHERE session_id=?;",
+                    [(session_id,) for session_id in cleared],
+                )
+                con.executemany(
+                    """INSERT INTO sessions (session_id, key, value, updated_at, accessed_at) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (session_id, key) DO UPDATE SET value=excluded.value, updated_at=excluded.updated_at, accessed_at=excluded.accessed_at;""",
+                    [(*k, v, now, now) for k, v in dirty.items()],
+                )
+                con.executemany(
+                    "UPDATE sessions SET accessed_at=? WHERE session_id=? AND key=?;",
+                    [(t, *k) for k, t in touched.items() if k not in dirty],
+                )
+                con.commit()
+            except sqlite3.Error as e:
+                logger.error(f"Error writing session data: {e}")
+                raise
+
+    def sweep(self, expires_before, limit):
+        with self.lock:
+            con = self._get_con()
+            r = con.execute(
+                """DELETE FROM sessions WHERE rowid IN (
+                    SELECT rowid FROM sessions WHERE accessed_at<? LIMIT ?
+                );""",
+                (expires_before, limit),
+            )
+            con.commit()
+        return r.rowcount
+
 
-    def add_session_entry(self, session_id, value, *, key=None):
-        file_name = f"{session_id}.{key}" if key else str(session_id)
-        file_path = os.path.join(self.base_path, file_name)
+class RedisSessionStore(SessionStore):
+    """
+    Sessions in a shared Redis protocol backend, one hash per session.
+    Every write or access renews the expiry of the hash.
+    """
 
-        logger.debug(f"Adding session data for {file_name}")
-        # logger.debug(f"Value {value}")
-        with open(file_path, mode="wb+") as file:
-            pickle.dump(value, file)
+    shared = True
 
-    def get_session_entry(self, session_id, *, key=None):
-        file_name = f"{session_id}.{key}" if key else str(session_id)
-        file_path = os.path.join(self.base_path, file_name)
+    def __init__(self, backend: RedisBackend, ttl=SESSION_TTL):
+        self.backend = backend
+        self.ttl = ttl
 
-        logger.debug(f"Fetching session data of {file_name}")
-        with open(file_path, mode="rb+") as file:
-            result = pickle.load(file)
-            # logger.debug(f"Result {result}")
-            return result
+    def load(self, entry_key):
+        session_id, key = entry_key
+        value = self.backend.hget(self.backend.key("session", session_id), key)
+        # Expired sessions are removed by the server
+        return (value, time.time()) if value is not None else None
+
+    def write(self, dirty, cleared, touched):
+        pipe = self.backend.pipeline()
+        for session_id in cleared:
+            pipe.delete(self.backend.key("session", session_id))
+        for (session_id, key), value in dirty.items():
+            pipe.hset(self.backend.key("session", session_id), key, value)
+        for session_id in {k[0] for k in [*dirty, *touched]}:
+            pipe.expire(self.backend.key("session", session_id), int(self.ttl))
+        pipe.execute()
+
+    def sweep(self, expires_before, limit):
+        return 0
+
+
+class SessionDatabase:
+    """
+    Session states, served from an in-memory LRU and written to a
+    `SessionStore` (sqlite by default) in the background. Changes are
+    coalesced and flushed at most `flush_delay` seconds after they happened,
+    and on shutdown.
 
-    def clear_session(self, session_id):
-        file_regex = r"{session_id}\..*"
-        all_files = os.listdir(self.base_path)
+    Shared stores are read and written on a worker thread instead, and
+    changes are written before the awaited call returns, so the next update
+    sees them on any instance.
 
+    Sessions not used for `ttl` seconds expire, and are removed by `sweep`.
+    """
+
+    flush_lock = Lock()
+    pending_lock = Lock()
+    store: SessionStore
+
+    def __init__(
+        self,
+        db_file=DEFAULT_PATH,
+        cache_entries=SESSION_CACHE_ENTRIES,
+        flush_delay=SESSION_FLUSH_DELAY,
+        ttl=SESSION_TTL,
+        store: Optional[SessionStore] = None,
+    ):
+        if store is None:
+            backend = get_backend()
+            store = (
+                RedisSessionStore(backend, ttl)
+                if backend
+                else SqliteSessionStore(db_file)
+            )
+        self.store = store
+        if store.shared:
+            # Other instances may change any session, so always read the store
+            cache_entries = 0
+        self.flush_delay = flush_delay
+        self.ttl = ttl
+        # (session_id, key) -> (value, last access)
+        self.cache = LRUCache(max_entries=cache_entries)
+        # Pending writes: (session_id, key) -> encoded value, cleared session ids
+        # and last accesses of entries that have only been read
+        self._dirty = {}
+        self._cleared = set()
+        self._touched = {}
+        self._flush_handle = None
+
+    def migrate(self, legacy_path=BASE_PATH):
+        # Import the former session files. Unpickling them imports the
+        # services, so this has to run once all of them are loaded.
+        legacy_path = Path(legacy_path)
+        if not legacy_path.is_dir():
+            return
+
+        logger.info(f"Migrating session files from {legacy_path}...")
+        migrated = []
+        failed = 0
+        for file in legacy_path.iterdir():
+            session_id, _, key = file.name.partition(".")
+            try:
+                with open(file, mode="rb") as f:
+                    value = pickle.load(f)
+                self._add(session_id, value, key=key or None)
+                migrated.append(file)
+            except Exception as e:
+                logger.warning(f"Could not migrate session file {file}: {e}")
+                failed += 1
+        self.flush()
+
+        if failed:
+            # Keep the failed files for another attempt, but not the migrated
+            # ones, which would overwrite newer session data
+            for file in migrated:
+                file.unlink()
+            logger.warning(
+                f"Migrated {len(migrated)} session entries, {failed} left in {legacy_path}"
+            )
+            return
+        legacy_path.rename(legacy_path.with_name(f"{legacy_path.name}.migrated"))
+        logger.info(f"Migrated {len(migrated)} session entries")
+
+    async def add_session_entry(self, session_id, value, *, key=None):
+        self._add(session_id, value, key=key)
+        if self.store.shared:
+            await asyncio.to_thread(self.flush)
+
+    async def get_session_entry(self, session_id, *, key=None):
+        if self.store.shared:
+            return await asyncio.to_thread(self._get, session_id, key=key)
+        return self._get(session_id, key=key)
+
+    async def clear_session(self, session_id):
+        self._clear(session_id)
+        if self.store.shared:
+            await asyncio.to_thread(self.flush)
+
+    def _add(self, session_id, value, *, key=None):
+        logger.debug(f"Adding session data for {session_id} [{key}]")
+        entry_key = (str(session_id), key or "")
+        data = encode(value)
+        self.cache.put(entry_key, (value, time.time()))
+        with self.pending_lock:
+            self._dirty[entry_key] = data
+        self._schedule_flush()
+
+    def _get(self, session_id, *, key=None):
+        logger.debug(f"Fetching session data of {session_id} [{key}]")
+        entry_key = (str(session_id), key or "")
+        now = time.time()
+        cached = self.cache.get(entry_key)
+        if cached is not None:
+            value, accessed_at = cached
+            if now - accessed_at > self.ttl:
+                logger.debug(f"Session data of {session_id} [{key}] expired")
+                self._clear(session_id)
+                return None
+            self._touch(entry_key, value, now)
+            return value
+
+        # Evicted from memory or cleared, but not yet written
+        with self.pending_lock:
+            data = self._dirty.get(entry_key)
+            cleared = entry_key[0] in self._cleared
+        if data is not None:
+            value = decode(data)
+            self._touch(entry_key, value, now)
+            return value
+        if cleared:
+            return None
+
+        record = self.store.load(entry_key)
+        if not record:
+            logger.debug(f"No session data found for {session_id} [{key}]")
+            return None
+        if now - record[1] > self.ttl:
+            logger.debug(f"Session data of {session_id} [{key}] expired")
+            return None
+        try:
+            value = decode(record[0], allow_pickle=self.store.legacy_pickles)
+        except SessionDecodeError as e:
+            logger.warning(f"Dropping undecodable session data of {session_id}: {e}")
+            return None
+        self._touch(entry_key, value, now)
+        return value
+
+    def _touch(self, entry_key, value, now):
+        self.cache.put(entry_key, (value, now))
+        with self.pending_lock:
+            self._touched[entry_key] = now
+        self._schedule_flush()
+
+    def _clear(self, session_id):
         logger.debug(f"Clearing session data of {session_id}")
-        for file in all_files:
-            if not re.match(file_regex, file):
-                continue
+        session_id = str(session_id)
+        for entry_key, _ in self.cache.items():
+            if entry_key[0] == session_id:
+                self.cache.pop(entry_key)
+        with self.pending_lock:
+            for entry_key in [k for k in self._dirty if k[0] == session_id]:
+                del self._dirty[entry_key]
+            self._cleared.add(session_id)
+        self._schedule_flush()
+
+    def _requeue(self, dirty, cleared, touched):
+        # Put back a batch that could not be written, changes made since win
+        with self.pending_lock:
+            for entry_key, data in dirty.items():
+                if entry_key[0] not in self._cleared:
+                    self._dirty.setdefault(entry_key, data)
+            for entry_key, accessed_at in touched.items():
+                if entry_key[0] not in self._cleared:
+                    self._touched.setdefault(entry_key, accessed_at)
+            self._cleared |= cleared
+
+    def sweep(self, limit=SESSION_SWEEP_BATCH):
+        # Remove up to `limit` expired sessions from the store, returns the number removed
+        # Write pending accesses first, so no session still in use is dropped
+        self.flush()
+        expires_before = time.time() - self.ttl
+        for entry_key, (_, accessed_at) in self.cache.items():
+            if accessed_at < expires_before:
+                self.cache.pop(entry_key)
+
+        removed = self.store.sweep(expires_before, limit)
+        logger.debug(f"Swept {removed} expired sessions")
+        return removed
+
+    def _schedule_flush(self):
+        if self._flush_handle or self.store.shared:
+            # Shared stores are flushed by the awaited calls
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Not running inside the bot (e.g. scripts), write through
+            self.flush()
+            return
+        self._flush_handle = loop.call_later(
+            self.flush_delay, self._flush_in_background, loop
+        )
+
+    def _flush_in_background(self, loop):
+        loop.run_in_executor(None, self.flush).add_done_callback(self._flush_done)
+
+    @staticmethod
+    def _flush_done(future):
+        if not future.cancelled() and future.exception():
+            logger.error(
+                f"Could not write session data, retrying with the next flush: {future.exception()!r}"
+            )
+
+    def flush(self):
+        # Swap and write under one lock, so batches reach the store in order
+        with self.flush_lock:
+            with self.pending_lock:
+                self._flush_handle = None
+                dirty, self._dirty = self._dirty, {}
+                cleared, self._cleared = self._cleared, set()
+                touched, self._touched = self._touched, {}
+            if not dirty and not cleared and not touched:
+                return
 
-            file_path = os.path.join(self.base_path, file)
-            logger.debug(f"Deleting {file}")
-            os.remove(file_path)
+            try:
+                self.store.write(dirty, cleared, touched)
+            except Exception:
+                self._requeue(dirty, cleared, touched)
+                raise
+            logger.debug(
+                f"Flushed {len(dirty)} session entries, cleared {len(cleared)} sessions"
+            )
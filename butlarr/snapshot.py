@@ -0,0 +1,54 @@
+import os
+import json
+
+from pathlib import Path
+from loguru import logger
+from typing import Any, Dict, Optional
+
+DEFAULT_PATH = os.path.join(
+    Path(os.path.dirname(os.path.realpath(__file__))).parent,
+    "data",
+    "services_snapshot.json",
+)
+
+
+class ServiceSnapshot:
+    """
+    Detected api versions, api urls and reference data of all services,
+    persisted so a restarted bot can serve requests before the services
+    have been probed again.
+    """
+
+    file: Path
+    services: Dict[str, Any]
+
+    def __init__(self, file=DEFAULT_PATH):
+        self.file = Path(file)
+        self.services = {}
+        try:
+            with open(self.file, "r") as f:
+                self.services = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable service snapshot [{self.file}]: {e}")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return self.services.get(key)
+
+    def put(self, key: str, data: Dict[str, Any]):
+        self.services[key] = data
+        self._save()
+
+    def _save(self):
+        # Write to a temporary file first, so a crash never leaves a partial snapshot
+        self.file.parent.mkdir(exist_ok=True, parents=True)
+        tmp_file = self.file.with_suffix(".tmp")
+        try:
+            with open(tmp_file, "w") as f:
+                json.dump(self.services, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self.file)
+        except OSError as e:
+            logger.error(f"Error writing service snapshot [{self.file}]: {e}")
@@ -1,7 +1,7 @@
 import shlex
 import inspect
 
-from typing import List, Tuple, Callable
+from typing import List, Tuple, Callable, Dict
 from loguru import logger
 from functools import wraps
 from telegram.ext import CommandHandler, CallbackQueryHandler
@@ -9,7 +9,16 @@ from typing import TypeAlias
 
 from ..config.commands import AUTH_COMMAND, HELP_COMMAND
 from ..config.secrets import ADMIN_AUTH_PASSWORD
-from ..database import Database
+from ..database import AsyncDatabase
+from ..deadline import deadline
+from .session_state import (
+    SESSION_TOKEN_SEP,
+    session_token,
+    session_scope,
+    reply_session_expired,
+)
+from .callback_data import encode_clbk, decode_clbk
+from .update_context import update_scope, current_update_context
 
 
 def escape_markdownv2_chars(text: str):
@@ -65,15 +74,31 @@ After doing so you can interact with the various services using:
     return CommandHandler(HELP_COMMAND, handler)
 
 
+async def parse_clbk(data: str):
+    # Returns the callback arguments and the session token they carry
+    args = await decode_clbk(data)
+    if not args:
+        return None, None
+    cmd, _, token = args[0].partition(SESSION_TOKEN_SEP)
+    return [cmd, *args[1:]], token or None
+
+
 def get_clbk_handler(services):
+    routes = {s.commands[0]: s for s in services}
+
     async def handler(update, context):
-        args = shlex.split(update.callback_query.data.strip())
+        args, token = await parse_clbk(update.callback_query.data)
+        if args is None:
+            logger.info("Callback payload is no longer stored")
+            await reply_session_expired(update)
+            return
         if args[0] == "noop":
             await update.callback_query.answer()
             return
         logger.debug(f"Received callback: {args}")
-        for s in services:
-            if args[0] == s.commands[0]:
+        s = routes.get(args[0])
+        if s:
+            with update_scope(update, args, token):
                 return await s.handle_callback(update, context)
         logger.error("Found no matching callback handler!")
 
@@ -119,6 +144,7 @@ def command(
 def handler(cls):
     cls.sub_commands = []
     cls.sub_callbacks = []
+    cls.callback_routes = {}
     cls.default_command = None
     cls.default_callback = None
     cls.default_description = ""
@@ -140,6 +166,8 @@ def handler(cls):
             has_default_command = True
         if hasattr(method, "clbk_cmds"):
             cls.sub_callbacks += [(cmd, method) for cmd in method.clbk_cmds]
+            for cmd in method.clbk_cmds:
+                cls.callback_routes.setdefault(cmd, method)
         if hasattr(method, "clbk_default"):
             assert not has_default_callback, "Only one default callback allowed."
             cls.default_callback = method
@@ -149,16 +177,27 @@ def handler(cls):
 
 
 class TelegramHandler:
-    db: Database
+    db: AsyncDatabase
     commands: List[CmdStr]
     sub_commands: List[Tuple[CmdStr, CmdPattern, CmdDescription, Callable]]
     sub_callbacks: List[Tuple[str, Callable]]
+    callback_routes: Dict[str, Callable]
 
     def register(self, application, db):
         self.db = db
         for cmd in self.commands:
             application.add_handler(CommandHandler(cmd, self.handle_command))
 
+    def is_ready(self):
+        return True
+
+    async def reply_not_ready(self, update):
+        text = f"{getattr(self, 'name', None) or self.commands[0]} is starting up or currently unavailable. Please try again in a moment."
+        if update.callback_query:
+            await update.callback_query.answer(text, show_alert=True)
+        else:
+            await update.message.reply_text(text)
+
     async def default_command(self, _update, _context, _args=None):
         del _update, _context, _args
         raise NotImplementedError
@@ -166,41 +205,57 @@ class TelegramHandler:
     async def handle_command(self, update, context):
         args = shlex.split(update.message.text.strip())
         logger.info(f"Received command: {args}")
+        if not self.is_ready():
+            await self.reply_not_ready(update)
+            return
 
-        if self.sub_commands and len(args) > 1:
-            for s, _, _, c in self.sub_commands:
-                if args[1] == s:
-                    logger.debug(f"Subcommand - Executing {s} ({c.__name__})")
-                    await c(self, update, context, args[1:])
-                    return
+        with update_scope(update, args), deadline():
+            if self.sub_commands and len(args) > 1:
+                for s, _, _, c in self.sub_commands:
+                    if args[1] == s:
+                        logger.debug(f"Subcommand - Executing {s} ({c.__name__})")
+                        await c(self, update, context, args[1:])
+                        return
 
-            logger.debug("No matching subcommand registered. Trying fallback")
-        try:
-            await self.default_command(update, context, args[1:])
-        except NotImplementedError:
-            logger.error("No default command handler registered.")
+                logger.debug("No matching subcommand registered. Trying fallback")
+            try:
+                await self.default_command(update, context, args[1:])
+            except NotImplementedError:
+                logger.error("No default command handler registered.")
 
     async def default_callback(self, _update, _context, _args=None):
         del _update, _context, _args
         raise NotImplementedError
 
     async def handle_callback(self, update, context):
-        args = shlex.split(update.callback_query.data.strip())
-        if args[0] != self.commands[0]:
+        # Parsed once by the callback handler
+        ctx = current_update_context(update)
+        if ctx.args:
+            args, token = ctx.args, ctx.session_token
+        else:
+            args, token = await parse_clbk(update.callback_query.data)
+        if not args or args[0] != self.commands[0]:
+            return
+        if not self.is_ready():
+            await self.reply_not_ready(update)
             return
-        if self.sub_callbacks and len(args) > 1:
-            for s, c in self.sub_callbacks:
-                if args[1] == s:
-                    logger.debug(f"Subcallback - Executing {s} ({c.__name__})")
+        with deadline(), session_scope(token):
+            if len(args) > 1:
+                c = self.callback_routes.get(args[1])
+                if c:
+                    logger.debug(f"Subcallback - Executing {args[1]} ({c.__name__})")
                     await c(self, update, context, args[1:])
                     return
 
-            logger.debug("No matching subcallback registered. Trying fallback")
-        try:
-            await self.default_callback(update, context, args[1:])
-        except NotImplementedError:
-            logger.error("No default callback handler registered.")
+                logger.debug("No matching subcallback registered. Trying fallback")
+            try:
+                await self.default_callback(update, context, args[1:])
+            except NotImplementedError:
+                logger.error("No default callback handler registered.")
 
     def get_clbk(self, *args: List[str]):
-        args = [self.commands[0], *args]
-        return (" ").join([f'"{arg}"' for arg in args])
+        cmd = self.commands[0]
+        token = session_token.get()
+        if token:
+            cmd = f"{cmd}{SESSION_TOKEN_SEP}{token}"
+        return encode_clbk([cmd, *args])
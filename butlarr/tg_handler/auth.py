@@ -13,7 +13,8 @@ from enum import Enum
 
 from ..config.commands import AUTH_COMMAND
 from ..config.secrets import ADMIN_AUTH_PASSWORD, MOD_AUTH_PASSWORD, USER_AUTH_PASSWORD
-from ..database import Database
+from ..database import AsyncDatabase
+from .update_context import current_update_context
 
 
 class AuthLevels(Enum):
@@ -23,13 +24,9 @@ class AuthLevels(Enum):
     ADMIN = 3
 
 
-def get_auth_level_from_message(db, update):
-    uid = (
-        update.message.from_user.id
-        if update.message
-        else update.callback_query.from_user.id
-    )
-    return db.get_auth_level(uid)
+async def get_auth_level_from_message(db, update):
+    # Loaded once per update, shared with the authorized decorator
+    return await current_update_context(update).auth_level(db)
 
 
 def authorized(min_auth_level=None):
@@ -43,12 +40,7 @@ def authorized(min_auth_level=None):
         async def wrapped_func(*args, **kwargs):
             # Ensure user is authorized
             update = args[1] if len(args) >= 2 else kwargs["update"]
-            uid = (
-                update.message.from_user.id
-                if update.message
-                else update.callback_query.from_user.id
-            )
-            auth_level = args[0].db.get_auth_level(uid)
+            auth_level = await get_auth_level_from_message(args[0].db, update)
             # TODO pjordan: Reenable this some time
             if not auth_level or min_auth_level > auth_level and False:
                 await update.message.reply_text(
@@ -64,22 +56,22 @@ def authorized(min_auth_level=None):
     return decorator
 
 
-def get_auth_handler(db: Database):
+def get_auth_handler(db: AsyncDatabase):
     async def handler(update, context):
         uid = update.message.from_user.id
         name = update.message.from_user.name
         pw_offset = len(AUTH_COMMAND) + 2
         password = update.message.text[pw_offset:].strip()
         if password == ADMIN_AUTH_PASSWORD:
-            db.add_user(uid, name, AuthLevels.ADMIN.value)
+            await db.add_user(uid, name, AuthLevels.ADMIN.value)
             await update.message.reply_text(f"Authorized user {name} as admin")
             await update.message.delete()
         elif password == MOD_AUTH_PASSWORD:
-            db.add_user(uid, name, AuthLevels.MOD.value)
+            await db.add_user(uid, name, AuthLevels.MOD.value)
             await update.message.reply_text(f"Authorized user {name} as mod")
             await update.message.delete()
         elif password == USER_AUTH_PASSWORD:
-            db.add_user(uid, name, AuthLevels.USER.value)
+            await db.add_user(uid, name, AuthLevels.USER.value)
             await update.message.reply_text(f"Authorized user {name}")
             await update.message.delete()
         else:
@@ -0,0 +1,90 @@
+import json
+import base64
+import asyncio
+import shlex
+import hashlib
+
+from typing import List, Optional
+
+from ..cache import LRUCache
+from ..backend import get_backend
+from ..config.cache import CALLBACK_PAYLOAD_ENTRIES
+from ..config.session import SESSION_TTL
+
+# Telegram's limit of callback_data, in bytes
+MAX_CALLBACK_DATA = 64
+SEP = "|"
+# Marks callback data referencing a payload in the store
+PAYLOAD_PREFIX = "#"
+# Bytes of the payload hash used as key
+PAYLOAD_KEY_SIZE = 12
+
+
+class PayloadStore:
+    """
+    Callback payloads that do not fit into Telegram's callback data, kept
+    server-side in an LRU (and the shared backend, if configured).
+
+    Payloads are put while building keyboards, so they are written to the
+    backend in the background. They are only needed once the message
+    carrying them has been sent and tapped.
+    """
+
+    def __init__(self, max_entries: int = CALLBACK_PAYLOAD_ENTRIES, backend=None):
+        self.cache = LRUCache(max_entries=max_entries)
+        self.backend = backend
+        self._writes = set()
+
+    def put(self, args: List[str]) -> str:
+        # Keyed by content, so redrawing a keyboard reuses the keys of its buttons
+        data = json.dumps(args).encode()
+        digest = hashlib.blake2b(data, digest_size=PAYLOAD_KEY_SIZE).digest()
+        key = base64.urlsafe_b64encode(digest).decode()
+        self.cache.put(key, args)
+        if self.backend:
+            write = (
+                self.backend.set,
+                self.backend.key("clbk", key),
+                data,
+                SESSION_TTL,
+            )
+            try:
+                task = asyncio.get_running_loop().create_task(asyncio.to_thread(*write))
+            except RuntimeError:
+                # Not running inside the bot, write through
+                write[0](*write[1:])
+            else:
+                self._writes.add(task)
+                task.add_done_callback(self._writes.discard)
+        return key
+
+    async def get(self, key: str) -> Optional[List[str]]:
+        args = self.cache.get(key)
+        if args is None and self.backend:
+            data = await asyncio.to_thread(self.backend.get, self.backend.key("clbk", key))
+            if data is not None:
+                args = json.loads(data)
+                self.cache.put(key, args)
+        return args
+
+
+payload_store = PayloadStore(backend=get_backend())
+
+
+def encode_clbk(args: List) -> str:
+    args = [str(arg) for arg in args]
+    data = SEP.join(args)
+    if len(data.encode()) <= MAX_CALLBACK_DATA and not any(SEP in arg for arg in args):
+        return data
+    return f"{PAYLOAD_PREFIX}{payload_store.put(args)}"
+
+
+async def decode_clbk(data: str) -> Optional[List[str]]:
+    # Returns None for payloads that are no longer stored
+    data = data.strip()
+    if data.startswith(PAYLOAD_PREFIX):
+        return await payload_store.get(data[len(PAYLOAD_PREFIX) :])
+    if data.startswith('"'):
+        # Quoted format of messages sent by earlier versions
+        return shlex.split(data)
+    return data.split(SEP)
@@ -1,4 +1,5 @@
 import shlex
+import inspect
 
 from typing import List, Tuple, Callable, Optional
 from loguru import logger
@@ -38,6 +39,15 @@ def keyboard(func):
         keyboard_markup = InlineKeyboardMarkup(keyboard)
         return keyboard_markup
 
+    if inspect.iscoroutinefunction(func):
+
+        @wraps(func)
+        async def async_wrapped_func(*args, **kwargs):
+            buttons = await func(*args, **kwargs)
+            return create_keyboard(buttons)
+
+        return async_wrapped_func
+
     @wraps(func)
     def wrapped_func(*args, **kwargs):
         buttons = func(*args, **kwargs)
@@ -4,13 +4,15 @@ from typing import List, Tuple, Callable, Optional, Literal
 from loguru import logger
 from functools import wraps
 from telegram.ext import CommandHandler, CallbackQueryHandler
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto, Message
 from telegram.error import BadRequest
 
 from dataclasses import dataclass
 from typing import Any
 
 from ..database import Database
+from ..deadline import ServiceTimeout
+from ..poster_cache import poster_cache, poster_store
 
 bad_request_poster_error_messages = [
     "Wrong type of the web page content",
@@ -18,6 +20,8 @@ bad_request_poster_error_messages = [
     "Media_empty",
 ]
 
+DEFAULT_POSTER = "https://artworks.thetvdb.com/banners/images/missing/movie.jpg"
+
 no_caption_error_messages = ["There is no caption in the message to edit"]
 no_edit_error_messages = [
     "Message is not modified: specified new message content and reply markup are exactly the same as a current content and reply markup of the message"
@@ -35,10 +39,26 @@ class Response:
     ] = None
 
 
+async def reply_service_timeout(update, error: ServiceTimeout):
+    # Keep the current message (and its session) untouched, so the user can retry
+    logger.warning(f"Aborting update: {error}")
+    if update.callback_query:
+        await update.callback_query.answer(str(error), show_alert=True)
+    else:
+        await update.message.reply_text(str(error))
+
+
 def clear(func):
     @wraps(func)
     async def wrapped_func(self, update, context, *args, **kwargs):
-        message = await func(self, update, context, *args, **kwargs)
+        try:
+            message = await func(self, update, context, *args, **kwargs)
+        except ServiceTimeout as e:
+            await reply_service_timeout(update, e)
+            return
+
+        if not message:
+            return
 
         if update.callback_query:
             await update.callback_query.message.reply_text(message.caption)
@@ -49,10 +69,59 @@ def clear(func):
     return wrapped_func
 
 
+async def send_poster(bot, chat_id, url, **kwargs):
+    # Send by cached file id where possible, otherwise upload the locally
+    # cached poster, and remember the file id of new uploads
+    if poster_cache.failed(url):
+        url = DEFAULT_POSTER
+    file_id = poster_cache.get(url)
+    photo = file_id or await poster_store.get(url) or url
+    try:
+        sent = await bot.send_photo(chat_id=chat_id, photo=photo, **kwargs)
+    except BadRequest as e:
+        if str(e) not in bad_request_poster_error_messages:
+            raise e
+        if file_id:
+            logger.warning(f"Cached poster of [{url}] was rejected: {e}. Resending...")
+            await poster_cache.forget(url)
+            return await send_poster(bot, chat_id, url, **kwargs)
+        if url == DEFAULT_POSTER:
+            raise e
+        logger.error(
+            f"Error sending photo [{url}]: BadRequest: {e}. Attempting to send with default poster..."
+        )
+        await poster_cache.put_failed(url)
+        return await send_poster(bot, chat_id, DEFAULT_POSTER, **kwargs)
+
+    if not file_id and sent.photo:
+        await poster_cache.put(url, sent.photo[-1].file_id)
+    return sent
+
+
+async def edit_poster(query, url, **kwargs):
+    # Replace the photo of the callback's message in place. Errors are left
+    # to the caller, which falls back to sending a new message
+    if poster_cache.failed(url):
+        url = DEFAULT_POSTER
+    file_id = poster_cache.get(url)
+    photo = file_id or await poster_store.get(url) or url
+    reply_markup = kwargs.pop("reply_markup", None)
+    edited = await query.edit_message_media(
+        media=InputMediaPhoto(photo, **kwargs), reply_markup=reply_markup
+    )
+    if not file_id and isinstance(edited, Message) and edited.photo:
+        await poster_cache.put(url, edited.photo[-1].file_id)
+    return edited
+
+
 def repaint(func):
     @wraps(func)
     async def wrapped_func(self, update, context, *args, **kwargs):
-        message = await func(self, update, context, *args, **kwargs)
+        try:
+            message = await func(self, update, context, *args, **kwargs)
+        except ServiceTimeout as e:
+            await reply_service_timeout(update, e)
+            return
 
         if not message:
             return
@@ -90,34 +159,36 @@ def repaint(func):
                     parse_mode=message.parse_mode,
                 )
         else:
+            # Navigating between results: swap the photo of the current message
+            if update.callback_query and update.callback_query.message.photo:
+                try:
+                    await edit_poster(
+                        update.callback_query,
+                        message.photo,
+                        caption=message.caption,
+                        reply_markup=message.reply_markup,
+                        parse_mode=message.parse_mode,
+                    )
+                    await update.callback_query.answer()
+                    return
+                except BadRequest as e:
+                    if e.message in no_edit_error_messages:
+                        await update.callback_query.answer()
+                        return
+                    logger.debug(f"Could not edit poster in place: {e}. Resending...")
+
             try:
-                await context.bot.send_photo(
-                    chat_id=(
+                await send_poster(
+                    context.bot,
+                    (
                         update.message.chat.id
                         if update.message
                         else update.callback_query.message.chat.id
                     ),
-                    photo=message.photo,
+                    message.photo,
                     caption=message.caption,
                     reply_markup=message.reply_markup,
                 )
-            except BadRequest as e:
-                if str(e) in bad_request_poster_error_messages:
-                    logger.error(
-                        f"Error sending photo [{message.photo}]: BadRequest: {e}. Attempting to send with default poster..."
-                    )
-                    await context.bot.send_photo(
-                        chat_id=(
-                            update.message.chat.id
-                            if update.message
-                            else update.callback_query.message.chat.id
-                        ),
-                        photo="https://artworks.thetvdb.com/banners/images/missing/movie.jpg",
-                        caption=message.caption,
-                        reply_markup=message.reply_markup,
-                    )
-                else:
-                    raise e
             finally:
                 if update.callback_query:
                     await update.callback_query.answer()
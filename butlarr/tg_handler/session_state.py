@@ -1,6 +1,10 @@
 import shlex
+import asyncio
+import secrets
 
-from typing import List, Tuple, Callable, Optional
+from contextlib import contextmanager, asynccontextmanager
+from contextvars import ContextVar
+from typing import List, Tuple, Callable, Optional, Dict
 from loguru import logger
 from functools import wraps
 from telegram.ext import CommandHandler, CallbackQueryHandler
@@ -11,6 +15,55 @@ from dataclasses import dataclass
 from typing import Any
 
 from ..session_database import SessionDatabase
+from ..prefetch import prefetcher
+from ..result_store import hydrate_state
+from .update_context import current_update_context
+
+# Separates the service command from the session token in callback data
+SESSION_TOKEN_SEP = "~"
+
+# Token of the search the current update belongs to. Every search message
+# gets its own token, carried in its callback data, so that several
+# searches in one chat keep separate sessions.
+session_token: ContextVar[Optional[str]] = ContextVar("session_token", default=None)
+
+
+@contextmanager
+def session_scope(token: Optional[str]):
+    reset_token = session_token.set(token)
+    try:
+        yield token
+    finally:
+        session_token.reset(reset_token)
+
+
+class KeyedLock:
+    """
+    One asyncio lock per key, dropped again once nobody holds or awaits it.
+
+    Updates for the same session are applied one after another, while
+    unrelated sessions run in parallel.
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, Tuple[asyncio.Lock, int]] = {}
+
+    @asynccontextmanager
+    async def __call__(self, key: str):
+        lock, waiters = self._locks.get(key) or (asyncio.Lock(), 0)
+        self._locks[key] = (lock, waiters + 1)
+        try:
+            async with lock:
+                yield
+        finally:
+            lock, waiters = self._locks[key]
+            if waiters > 1:
+                self._locks[key] = (lock, waiters - 1)
+            else:
+                del self._locks[key]
+
+
+session_locks = KeyedLock()
 
 
 def get_chat_id(update):
@@ -19,8 +72,28 @@ def get_chat_id(update):
     return update.message.chat_id
 
 
+async def reply_session_expired(update):
+    text = "This search has expired. Please start a new search."
+    if update.callback_query:
+        await update.callback_query.answer(text, show_alert=True)
+        try:
+            await update.callback_query.edit_message_reply_markup(reply_markup=None)
+        except BadRequest as e:
+            logger.debug(f"Could not remove keyboard of expired message: {e}")
+    else:
+        await update.message.reply_text(text)
+
+
+def search_key(self):
+    # Identifies the current search independent of the update, e.g. for background work
+    return (self.commands[0], session_token.get())
+
+
 def default_session_state_key_fn(self, update):
-    return str(self.commands[0]) + str(get_chat_id(update))
+    key = str(self.commands[0]) + str(get_chat_id(update))
+    token = session_token.get()
+    # Messages sent before session tokens existed still use the per-chat key
+    return f"{key}:{token}" if token else key
 
 
 def sessionState(key_fn=default_session_state_key_fn, clear=False, init=False):
@@ -28,20 +101,33 @@ def sessionState(key_fn=default_session_state_key_fn, clear=False, init=False):
 
         @wraps(func)
         async def wrapped_func(self, update, context, *args, **kwargs):
-            # init calls do not need a state, as they will create it first
+            # init calls do not need a state, as they will create it first.
+            # New searches get a fresh token, addons opened from a search keep its token
             if init:
-                return await func(self, update, context, *args, **kwargs)
+                with session_scope(session_token.get() or secrets.token_urlsafe(6)):
+                    return await func(self, update, context, *args, **kwargs)
 
-            # get state
             key = key_fn(self, update)
-            state = self.session_db.get_session_entry(key)
-            result = await func(self, update, context, *args, **kwargs, state=state)
+            # Serialize updates of this session, e.g. double tapped buttons
+            ctx = current_update_context(update)
+            async with session_locks(key):
+                with ctx.stage("session"):
+                    state = await self.session_db.get_session_entry(key)
+                    if state:
+                        state = await hydrate_state(self, state)
+                if not state:
+                    logger.info(f"No session state for {key}, it may have expired")
+                    await reply_session_expired(update)
+                    return None
+                result = await func(self, update, context, *args, **kwargs, state=state)
 
-            if clear:
-                self.session_db.clear_session(key)
-            else:
-                self.session_db.add_session_entry(key, result.state)
-            return result
+                if clear:
+                    await self.session_db.clear_session(key)
+                    prefetcher.cancel(search_key(self))
+                elif result and result.state is not None:
+                    # Responses without a state (e.g. denied actions) keep the current one
+                    await self.session_db.add_session_entry(key, result.state)
+                return result
 
         return wrapped_func
 
@@ -0,0 +1,76 @@
+import time
+
+from loguru import logger
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from .. import metrics
+
+_UNSET = object()
+
+
+@dataclass
+class UpdateContext:
+    """
+    Everything derived from one update, computed at most once and shared by
+    the handler decorators: the parsed arguments, the sender's auth level and
+    the time spent in each stage.
+    """
+
+    update: Any
+    args: List[str]
+    session_token: Optional[str] = None
+    timings: Dict[str, float] = field(default_factory=dict)
+    _auth_level: Any = _UNSET
+
+    @property
+    def user_id(self):
+        if self.update.message:
+            return self.update.message.from_user.id
+        return self.update.callback_query.from_user.id
+
+    async def auth_level(self, db):
+        if self._auth_level is _UNSET:
+            with self.stage("auth"):
+                self._auth_level = await db.get_auth_level(self.user_id)
+        return self._auth_level
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+            metrics.observe(f"update.{name}", elapsed)
+
+
+_current: ContextVar[Optional[UpdateContext]] = ContextVar(
+    "update_context", default=None
+)
+
+
+@contextmanager
+def update_scope(update, args: List[str], session_token: Optional[str] = None):
+    ctx = UpdateContext(update=update, args=args, session_token=session_token)
+    token = _current.set(ctx)
+    try:
+        with ctx.stage("total"):
+            yield ctx
+    finally:
+        _current.reset(token)
+        logger.debug(
+            "Update stages: "
+            + ", ".join(f"{k} {v * 1000:.1f}ms" for k, v in ctx.timings.items())
+        )
+
+
+def current_update_context(update) -> UpdateContext:
+    # Context of the update being handled, or a fresh one outside of a scope
+    ctx = _current.get()
+    if ctx is None or ctx.update is not update:
+        ctx = UpdateContext(update=update, args=[])
+    return ctx
@@ -0,0 +1,8 @@
+import os
+from pathlib import Path
+
+# The config is read on import, tests run against the template
+os.environ.setdefault(
+    "BUTLARR_CONFIG_FILE",
+    str(Path(__file__).parent.parent / "templates" / "config.yaml"),
+)
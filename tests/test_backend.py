@@ -0,0 +1,100 @@
+import pickle
+import asyncio
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from butlarr.backend import RedisBackend
+from butlarr.lookup_cache import LookupCache
+from butlarr.result_store import ResultStore
+from butlarr.session_database import RedisSessionStore, SessionDatabase
+
+
+@pytest.fixture
+def backends():
+    # Two instances sharing one server
+    server = fakeredis.FakeServer()
+    return [
+        RedisBackend(client=fakeredis.FakeRedis(server=server), prefix="test")
+        for _ in range(2)
+    ]
+
+
+def test_sessions_are_shared(backends):
+    a, b = [SessionDatabase(store=RedisSessionStore(backend)) for backend in backends]
+
+    async def run():
+        await a.add_session_entry("series1:T", {"index": 1})
+        assert await b.get_session_entry("series1:T") == {"index": 1}
+        await b.add_session_entry("series1:T", {"index": 2})
+        assert await a.get_session_entry("series1:T") == {"index": 2}
+        await a.clear_session("series1:T")
+        assert await b.get_session_entry("series1:T") is None
+
+    asyncio.run(run())
+
+
+def test_results_are_shared_and_renewed(backends):
+    a, b = [ResultStore(backend=backend, ttl=60) for backend in backends]
+    client = backends[0].client
+    items = [{"title": "x", "tvdbId": 1}]
+
+    async def run():
+        key = await a.put(items)
+        redis_key = backends[0].key("results", key)
+        client.pexpire(redis_key, 1000)
+        assert await b.get(key) == items
+        assert client.pttl(redis_key) > 1000
+        # Reading from memory renews as well
+        client.pexpire(redis_key, 1000)
+        assert await a.get(key) == items
+        assert client.pttl(redis_key) > 1000
+
+    asyncio.run(run())
+
+
+def test_lookups_are_shared_and_invalidated(backends, tmp_path):
+    a, b = [
+        LookupCache(db_file=tmp_path / f"{i}.sqlite", backend=backend)
+        for i, backend in enumerate(backends)
+    ]
+    results = [{"title": "Dune", "tmdbId": 438631}]
+
+    async def run():
+        await a.put("radarr", "Dune", results)
+        assert await b.get("radarr", " dune ") == results
+        await b.invalidate("radarr", results[0])
+        assert await a.get("radarr", "Dune") is None
+
+    asyncio.run(run())
+
+
+def test_undecodable_results_are_a_miss(backends):
+    store = ResultStore(backend=backends[0], ttl=60)
+    backends[0].set(backends[0].key("results", "corrupt"), b"\x01\xc1", 60)
+    assert asyncio.run(store.get("corrupt")) is None
+
+
+unpickled = []
+
+
+def _unpickle():
+    unpickled.append(True)
+
+
+class Payload:
+    def __reduce__(self):
+        return (_unpickle, ())
+
+
+def test_pickles_from_the_backend_are_rejected(backends):
+    backend = backends[0]
+    sessions = SessionDatabase(store=RedisSessionStore(backend))
+    results = ResultStore(backend=backend, ttl=60)
+    data = pickle.dumps(Payload())
+    backend.client.hset(backend.key("session", "series1:T"), "", data)
+    backend.set(backend.key("results", "pickled"), data, 60)
+
+    assert asyncio.run(sessions.get_session_entry("series1:T")) is None
+    assert asyncio.run(results.get("pickled")) is None
+    assert not unpickled
@@ -0,0 +1,50 @@
+from butlarr.cache import LRUCache
+
+
+def test_evicts_least_recently_used_entries():
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert [k for k, _ in cache.items()] == ["a", "c"]
+
+
+def test_evicts_by_size():
+    cache = LRUCache(max_size=5)
+    cache.put("a", "abc")
+    cache.put("b", "de")
+    assert cache.size == 5
+    cache.put("c", "f")
+    assert "a" not in cache
+    assert cache.size == 3
+
+
+def test_replacing_an_entry_updates_its_size():
+    cache = LRUCache(max_size=10)
+    cache.put("a", "abcd")
+    cache.put("a", "ab")
+    assert cache.size == 2
+    assert cache.pop("a") == "ab"
+    assert cache.size == 0
+
+
+def test_on_evict_is_called_with_evicted_entries():
+    evicted = []
+    cache = LRUCache(max_entries=1, on_evict=lambda k, v: evicted.append((k, v)))
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert evicted == [("a", 1)]
+    # Popped and cleared entries are not evicted
+    cache.pop("b")
+    cache.put("c", 3)
+    cache.clear()
+    assert evicted == [("a", 1)]
+
+
+def test_zero_entries_keeps_nothing():
+    cache = LRUCache(max_entries=0)
+    cache.put("a", 1)
+    assert cache.get("a") is None
+    assert len(cache) == 0
@@ -0,0 +1,58 @@
+import asyncio
+import pytest
+
+from butlarr.tg_handler.callback_data import (
+    MAX_CALLBACK_DATA,
+    PAYLOAD_PREFIX,
+    PayloadStore,
+    decode_clbk,
+    encode_clbk,
+)
+
+
+def decode(data):
+    return asyncio.run(decode_clbk(data))
+
+
+def test_short_args_are_inlined():
+    data = encode_clbk(["series~T", "goto", 1])
+    assert data == "series~T|goto|1"
+    assert decode(data) == ["series~T", "goto", "1"]
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ["series", "selectpath", "/a/very/long/root/folder/path/that/does/not/fit/at/all"],
+        ["series", "search", "with|separator"],
+    ],
+    ids=["too long", "separator"],
+)
+def test_other_args_are_stored(args):
+    data = encode_clbk(args)
+    assert data.startswith(PAYLOAD_PREFIX)
+    assert len(data.encode()) <= MAX_CALLBACK_DATA
+    assert decode(data) == args
+
+
+def test_legacy_quoted_format():
+    assert decode('"series" "search" "The Office"') == ["series", "search", "The Office"]
+
+
+def test_missing_payload():
+    assert decode(f"{PAYLOAD_PREFIX}unknown") is None
+
+
+def test_payloads_are_evicted():
+    store = PayloadStore(max_entries=1)
+    first = store.put(["a"])
+    second = store.put(["b"])
+    assert asyncio.run(store.get(first)) is None
+    assert asyncio.run(store.get(second)) == ["b"]
+
+
+def test_identical_payloads_share_a_key():
+    store = PayloadStore()
+    assert store.put(["a", "b"]) == store.put(["a", "b"])
+    assert store.put(["a", "b"]) != store.put(["a|b"])
+    assert len(store.cache) == 2
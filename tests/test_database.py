@@ -0,0 +1,62 @@
+import time
+import asyncio
+import pytest
+
+from butlarr.database import Database, AsyncDatabase
+
+
+@pytest.fixture
+def db(tmp_path):
+    return Database(tmp_path / "db.sqlite")
+
+
+def test_queries_run_in_order(db):
+    async def run():
+        adb = AsyncDatabase(db, max_pending=4)
+        await asyncio.gather(*(adb.add_user(i, f"user{i}", 1) for i in range(20)))
+        await adb.update_auth_level(3, 2)
+        assert len(await adb.get_users()) == 20
+        assert await adb.get_users(auth_level=2) == [
+            {"id": 3, "username": "user3", "auth_level": 2}
+        ]
+        assert await adb.get_auth_level(3) == 2
+        await adb.close()
+
+    asyncio.run(run())
+
+
+def test_slow_queries_do_not_block_the_loop(db):
+    update_auth_level = db.update_auth_level
+
+    def slow_update(*args):
+        time.sleep(0.2)
+        update_auth_level(*args)
+
+    db.update_auth_level = slow_update
+
+    async def run():
+        adb = AsyncDatabase(db)
+        await adb.add_user(1, "user", 1)
+        start = time.perf_counter()
+        task = asyncio.ensure_future(adb.update_auth_level(1, 2))
+        await asyncio.sleep(0.01)
+        # Answered from memory meanwhile
+        assert await adb.get_auth_level(1) == 1
+        assert time.perf_counter() - start < 0.1
+        await task
+        assert await adb.get_auth_level(1) == 2
+        await adb.close()
+
+    asyncio.run(run())
+
+
+def test_errors_are_raised_to_the_caller(db):
+    async def run():
+        adb = AsyncDatabase(db)
+        with pytest.raises(ZeroDivisionError):
+            await adb._run(lambda: 1 / 0)
+        # The worker keeps running
+        await adb.add_user(1, "user", 1)
+        await adb.close()
+
+    asyncio.run(run())
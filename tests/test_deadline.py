@@ -0,0 +1,59 @@
+import asyncio
+import contextvars
+import httpx
+import pytest
+
+from butlarr.deadline import ServiceTimeout, deadline, remaining, request_timeout
+from butlarr.services.radarr import Radarr
+
+
+@pytest.fixture
+def service():
+    service = Radarr(commands=["movie"], api_host="http://radarr", api_key="key")
+    service.api_url = "http://radarr/api/v3"
+    return service
+
+
+def test_requests_are_clamped_to_the_deadline():
+    assert request_timeout(10) == 10
+    with deadline(1):
+        assert request_timeout(10) <= 1
+        assert request_timeout(0.5) == 0.5
+    assert remaining() is None
+
+
+def test_background_tasks_do_not_inherit_the_deadline():
+    async def budget():
+        return remaining()
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        with deadline(1):
+            inherited = loop.create_task(budget())
+            detached = loop.create_task(budget(), context=contextvars.Context())
+            return await inherited, await detached
+
+    inherited, detached = asyncio.run(run())
+    assert inherited is not None
+    assert detached is None
+
+
+def test_service_requests_use_the_remaining_budget(service):
+    timeouts = []
+
+    async def get(endpoint, params={}, timeout=None):
+        timeouts.append(timeout)
+        return httpx.Response(200, json={}, request=httpx.Request("GET", endpoint))
+
+    service._get = get
+
+    async def run():
+        with deadline(1):
+            await service.request("movie")
+        with deadline(0):
+            with pytest.raises(ServiceTimeout):
+                await service.request("movie", params={"id": 1})
+
+    asyncio.run(run())
+    assert len(timeouts) == 1
+    assert 0 < timeouts[0] <= 1
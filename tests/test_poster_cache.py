@@ -0,0 +1,39 @@
+import asyncio
+
+from butlarr.deadline import deadline, remaining
+from butlarr.poster_cache import PosterCache, PosterStore
+
+
+def test_forgotten_file_ids_are_not_reloaded(tmp_path):
+    cache = PosterCache(db_file=tmp_path / "posters.sqlite")
+
+    async def run():
+        await cache.put("http://img/a.jpg", "file-a")
+        await cache.put("http://img/b.jpg", "file-b")
+        await cache.forget("http://img/a.jpg")
+
+    asyncio.run(run())
+    assert cache.get("http://img/a.jpg") is None
+
+    reloaded = PosterCache(db_file=tmp_path / "posters.sqlite")
+    reloaded.load()
+    assert reloaded.get("http://img/a.jpg") is None
+    assert reloaded.get("http://img/b.jpg") == "file-b"
+
+
+def test_prefetch_is_not_bound_to_the_update_deadline(tmp_path):
+    store = PosterStore(path=tmp_path / "posters")
+    budgets = []
+
+    async def fetch(url, name):
+        budgets.append(remaining())
+
+    store._fetch = fetch
+
+    async def run():
+        with deadline(1):
+            store.prefetch(["http://img/a.jpg"])
+        await asyncio.gather(*store._fetching.values())
+
+    asyncio.run(run())
+    assert budgets == [None]
@@ -0,0 +1,66 @@
+import asyncio
+
+from butlarr.prefetch import Prefetcher
+from butlarr.services.transport import SingleFlight
+
+
+class Calls:
+    # Slow calls, counting how many run at once
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self.cancelled = 0
+
+    async def call(self, result=None):
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(0.05)
+            return result
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.running -= 1
+
+
+def test_call_is_cancelled_with_its_last_caller():
+    async def run():
+        calls, flight = Calls(), SingleFlight()
+        caller = asyncio.ensure_future(flight.do("k", calls.call))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        await asyncio.wait([caller])
+        assert calls.cancelled == 1
+        assert calls.running == 0
+
+    asyncio.run(run())
+
+
+def test_call_keeps_running_for_remaining_callers():
+    async def run():
+        calls, flight = Calls(), SingleFlight()
+        first = asyncio.ensure_future(flight.do("k", lambda: calls.call("r")))
+        second = asyncio.ensure_future(flight.do("k", lambda: calls.call("other")))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        assert await second == "r"
+        assert calls.cancelled == 0
+
+    asyncio.run(run())
+
+
+def test_rescheduling_stops_previous_requests_within_the_cap():
+    async def run():
+        calls, flight, prefetcher = Calls(), SingleFlight(), Prefetcher(concurrency=2)
+        for i in range(10):
+            jobs = [lambda i=i, j=j: flight.do((i, j), calls.call) for j in range(3)]
+            prefetcher.schedule("session", jobs)
+            await asyncio.sleep(0.01)
+        prefetcher.cancel("session")
+        await asyncio.sleep(0.01)
+        assert calls.max_running <= 2
+        assert calls.cancelled > 0
+        assert calls.running == 0
+
+    asyncio.run(run())
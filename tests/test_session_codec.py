@@ -0,0 +1,110 @@
+import pickle
+import pytest
+
+from dataclasses import dataclass
+from enum import Enum
+from typing import List, Optional
+
+from butlarr.session_codec import (
+    COMPRESS_THRESHOLD,
+    FORMAT_PLAIN,
+    FORMAT_ZLIB,
+    SessionDecodeError,
+    _session_types,
+    decode,
+    encode,
+    migration,
+    register_reference,
+    session_type,
+)
+
+
+class Color(Enum):
+    RED = "red"
+
+
+register_reference(Color, "test.Color", lambda c: c.value, Color)
+
+
+@session_type("test.Inner")
+@dataclass(frozen=True)
+class Inner:
+    values: List[int]
+
+
+@session_type("test.Outer", version=2)
+@dataclass(frozen=True)
+class Outer:
+    name: str
+    inner: Inner
+    color: Color
+    note: Optional[str] = None
+
+
+@migration("test.Outer", 1)
+def _add_note(values):
+    return {**values, "note": "migrated"}
+
+
+@dataclass
+class Pickled:
+    value: int
+
+
+def test_round_trip():
+    value = Outer(name="x", inner=Inner(values=[1, 2]), color=Color.RED, note="n")
+    data = encode(value)
+    assert data[:1] == FORMAT_PLAIN
+    assert decode(data) == value
+
+
+def test_large_values_are_compressed():
+    value = Inner(values=list(range(COMPRESS_THRESHOLD)))
+    data = encode(value)
+    assert data[:1] == FORMAT_ZLIB
+    assert decode(data) == value
+
+
+def test_older_versions_are_migrated(monkeypatch):
+    monkeypatch.setitem(_session_types, "test.Outer", (Outer, 1))
+    data = encode(Outer(name="x", inner=Inner(values=[]), color=Color.RED))
+    monkeypatch.setitem(_session_types, "test.Outer", (Outer, 2))
+    assert decode(data).note == "migrated"
+
+
+def test_newer_versions_are_rejected(monkeypatch):
+    monkeypatch.setitem(_session_types, "test.Outer", (Outer, 3))
+    data = encode(Outer(name="x", inner=Inner(values=[]), color=Color.RED))
+    monkeypatch.setitem(_session_types, "test.Outer", (Outer, 2))
+    with pytest.raises(SessionDecodeError):
+        decode(data)
+
+
+def test_unregistered_values_are_not_encoded():
+    with pytest.raises(TypeError):
+        encode(Pickled(value=1))
+
+
+def test_legacy_pickles_are_decoded():
+    data = pickle.dumps(Pickled(value=1))
+    assert decode(data, allow_pickle=True) == Pickled(value=1)
+
+
+def test_pickles_are_rejected_by_default():
+    with pytest.raises(SessionDecodeError):
+        decode(pickle.dumps(Pickled(value=1)))
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        b"\x00abc",
+        FORMAT_PLAIN + b"\xc1",
+        encode(Inner(values=list(range(COMPRESS_THRESHOLD))))[:20],
+        pickle.dumps(Pickled(value=1))[:-3],
+    ],
+    ids=["unknown format", "corrupt", "truncated", "truncated pickle"],
+)
+def test_invalid_data_raises_decode_error(data):
+    with pytest.raises(SessionDecodeError):
+        decode(data, allow_pickle=True)
@@ -0,0 +1,86 @@
+import asyncio
+
+from butlarr.session_database import SessionDatabase, SqliteSessionStore
+
+
+class FailingStore(SqliteSessionStore):
+    # Fails the next `failures` writes
+    failures = 0
+
+    def write(self, dirty, cleared, touched):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk full")
+        super().write(dirty, cleared, touched)
+
+
+def test_failed_flush_is_retried(tmp_path):
+    store = FailingStore(tmp_path / "session.sqlite")
+    db = SessionDatabase(store=store, flush_delay=0.01)
+
+    async def run():
+        await db.add_session_entry("a", {"index": 1})
+        await db.add_session_entry("b", {"index": 1})
+        await db.add_session_entry("c", {"index": 1})
+        store.failures = 1
+        await asyncio.sleep(0.1)
+        # Changes made since the failed flush win over the requeued ones
+        await db.add_session_entry("a", {"index": 2})
+        await db.clear_session("b")
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    assert store.failures == 0
+    assert store.load(("c", ""))
+    db.cache.clear()
+    assert asyncio.run(db.get_session_entry("a")) == {"index": 2}
+    assert store.load(("b", "")) is None
+
+
+def test_changes_are_flushed_after_delay(tmp_path):
+    store = SqliteSessionStore(tmp_path / "session.sqlite")
+    db = SessionDatabase(store=store, flush_delay=0.05)
+
+    async def run():
+        await db.add_session_entry("a", {"index": 1})
+        await db.add_session_entry("a", {"index": 2})
+        assert store.load(("a", "")) is None
+        await asyncio.sleep(0.1)
+
+    asyncio.run(run())
+    db.cache.clear()
+    assert asyncio.run(db.get_session_entry("a")) == {"index": 2}
+
+
+def test_expired_entries_are_not_returned(tmp_path):
+    store = SqliteSessionStore(tmp_path / "session.sqlite")
+    db = SessionDatabase(store=store, ttl=0.05)
+
+    async def run():
+        await db.add_session_entry("a", {"index": 1})
+        await db.add_session_entry("b", {"index": 1})
+        db.flush()
+        await asyncio.sleep(0.1)
+        # From memory
+        assert await db.get_session_entry("a") is None
+        # From the store
+        db.cache.clear()
+        assert await db.get_session_entry("b") is None
+
+    asyncio.run(run())
+
+
+def test_sweep_is_bounded(tmp_path):
+    store = SqliteSessionStore(tmp_path / "session.sqlite")
+    db = SessionDatabase(store=store, ttl=0.05)
+
+    async def run():
+        for session_id in "abcde":
+            await db.add_session_entry(session_id, {"index": 1})
+        db.flush()
+        await asyncio.sleep(0.1)
+        await db.add_session_entry("f", {"index": 1})
+
+    asyncio.run(run())
+    assert [db.sweep(2), db.sweep(2), db.sweep(2)] == [2, 2, 1]
+    assert store.load(("f", ""))
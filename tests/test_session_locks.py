@@ -0,0 +1,42 @@
+import asyncio
+
+from butlarr.tg_handler.session_state import KeyedLock
+
+
+def test_updates_of_a_session_run_one_after_another():
+    locks, events = KeyedLock(), []
+
+    async def update(key, name, duration):
+        async with locks(key):
+            events.append(f"{name} start")
+            await asyncio.sleep(duration)
+            events.append(f"{name} end")
+
+    async def run():
+        await asyncio.gather(
+            update("a", "a1", 0.05), update("a", "a2", 0.01), update("b", "b1", 0.01)
+        )
+
+    asyncio.run(run())
+    # Other sessions are not held up
+    assert events == ["a1 start", "b1 start", "b1 end", "a1 end", "a2 start", "a2 end"]
+    assert not locks._locks
+
+
+def test_lock_is_dropped_when_its_holder_is_cancelled():
+    locks = KeyedLock()
+
+    async def update():
+        async with locks("a"):
+            await asyncio.sleep(1)
+
+    async def run():
+        task = asyncio.ensure_future(update())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        assert not locks._locks
+        async with locks("a"):
+            pass
+
+    asyncio.run(run())